@@ -1,13 +1,21 @@
+import asyncio
+import json
+from typing import List
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
 from app.config import Config
 from app.logger import setup_logger
-from app.search_utils import search_documents
+from app.search_utils import search_documents, search_documents_batch
 from app.document_utils import add_document_to_store
-from app.chat_utils import chat_with_model
+from app.chat_utils import chat_with_model, stream_chat_with_model
 from app.urlparser_utils import parse_and_save_urls
 from app.urlslistaddbd_utils import add_urls_from_file
-from app.table_management import router as table_router  # Импорт маршрутов таблицы
+from app.store_utils import get_vectorstore, close_vector_stores, get_cache_stats, warm_up_embeddings
+from app.rerank_utils import get_rerank_stats
+from app.ollama_utils import get_ollama_monitor, warm_up_model
+from app.executor_utils import configure_executors, get_executor, run_in_executor, shutdown_executors
+from app.table_management import router as table_router, close_db_connections  # Импорт маршрутов таблицы
 
 # Инициализация FastAPI
 app = FastAPI()
@@ -21,15 +29,54 @@ config = Config.load("config.yaml")
 # Настройка логирования
 logger = setup_logger(config)
 
+@app.on_event("startup")
+def open_vector_store():
+    """
+    Открывает общее векторное хранилище при старте API и в фоне загружает модель
+    эмбеддингов и модель чата, чтобы первые запросы не ждали загрузки.
+    """
+    configure_executors(config)
+    get_vectorstore(config, log_func=logger.info)
+    get_ollama_monitor(config, log_func=logger.info).start()
+    # Прогрев моделей в фоне, не задерживая старт API
+    get_executor("search").submit(warm_up_embeddings, config, log_func=logger.info)
+    get_executor("llm").submit(warm_up_model, config, log_func=logger.info)
+
+@app.on_event("shutdown")
+def shutdown_vector_store():
+    """
+    Останавливает пулы потоков и закрывает векторное хранилище при остановке API.
+    """
+    get_ollama_monitor(config).stop()
+    shutdown_executors()
+    close_vector_stores(log_func=logger.info)
+    close_db_connections()
+
 # Модели для API
 class AddDocumentRequest(BaseModel):
     source: str
     tag: str
+    force: bool = False
+
+class SearchOptions(BaseModel):
+    k: int = None
+    max_distance: float = None
+    mmr: bool = None
+    fetch_k: int = None
+    mmr_lambda: float = None
+    mode: str = None
+
+class SearchRequest(SearchOptions):
+    query: str
+    tag: str = None
 
-class SearchRequest(BaseModel):
+class SearchQuery(BaseModel):
     query: str
     tag: str = None
 
+class SearchBatchRequest(SearchOptions):
+    queries: List[SearchQuery]
+
 class ChatRequest(BaseModel):
     query: str
     context: str = None
@@ -43,6 +90,8 @@ class ParseLinksRequest(BaseModel):
 
 class AddUrlsFromFileRequest(BaseModel):
     url_list_path: str = "urlslist.txt"
+    force: bool = False
+    concurrency: int = None
 
 @app.get("/")
 async def root():
@@ -51,18 +100,38 @@ async def root():
     """
     return {"message": "Добро пожаловать в API хранилища документов"}
 
+@app.get("/ready")
+async def ready():
+    """
+    Готовность сервиса: последнее известное состояние сервера Ollama (без сетевой проверки).
+    """
+    ollama_status = get_ollama_monitor(config).status()
+    status_code = 200 if ollama_status["healthy"] else 503
+    return JSONResponse(status_code=status_code, content={"ollama": ollama_status})
+
+@app.get("/stats")
+async def stats():
+    """
+    Статистика кэшей (попадания и промахи) и переранжирования.
+    """
+    return {**get_cache_stats(), "rerank": get_rerank_stats()}
+
 @app.post("/add-document")
 async def add_document_api(request: AddDocumentRequest):
     """
     Добавление документа (файла или URL) в векторное хранилище через API.
     """
     try:
-        add_document_to_store(
+        added = await run_in_executor(
+            "ingest", add_document_to_store,
             source=request.source,
             tag=request.tag.strip(),
             config=config,
-            log_func=logger.info
+            log_func=logger.info,
+            force=request.force
         )
+        if not added:
+            return {"message": f"Документ '{request.source}' не изменился, повторная загрузка не требуется"}
         return {"message": f"Документ '{request.source}' успешно добавлен с тегом: {request.tag}"}
     except Exception as e:
         logger.error(f"Ошибка при добавлении документа: {e}")
@@ -74,24 +143,56 @@ async def search_documents_api(request: SearchRequest):
     Поиск документов в векторном хранилище через API.
     """
     try:
-        results = search_documents(
+        results = await run_in_executor(
+            "search", search_documents,
             query=request.query,
             tag=request.tag,
             config=config,
-            log_func=logger.info
+            log_func=logger.info,
+            k=request.k,
+            max_distance=request.max_distance,
+            mmr=request.mmr,
+            fetch_k=request.fetch_k,
+            mmr_lambda=request.mmr_lambda,
+            mode=request.mode
         )
         return {"results": results}
     except Exception as e:
         logger.error(f"Ошибка при поиске: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при выполнении поиска")
 
+@app.post("/search/batch")
+async def search_documents_batch_api(request: SearchBatchRequest):
+    """
+    Пакетный поиск документов: несколько запросов с тегами за одно обращение.
+    Результаты возвращаются в порядке запросов.
+    """
+    try:
+        results = await run_in_executor(
+            "search", search_documents_batch,
+            queries=[{"query": item.query, "tag": item.tag} for item in request.queries],
+            config=config,
+            log_func=logger.info,
+            k=request.k,
+            max_distance=request.max_distance,
+            mmr=request.mmr,
+            fetch_k=request.fetch_k,
+            mmr_lambda=request.mmr_lambda,
+            mode=request.mode
+        )
+        return {"results": results}
+    except Exception as e:
+        logger.error(f"Ошибка при пакетном поиске: {e}")
+        raise HTTPException(status_code=500, detail="Ошибка при выполнении пакетного поиска")
+
 @app.post("/chat")
 async def chat_with_model_api(request: ChatRequest):
     """
     Общение с моделью через API.
     """
     try:
-        response = chat_with_model(
+        response = await run_in_executor(
+            "llm", chat_with_model,
             query=request.query,
             context=request.context,
             tag=request.tag,
@@ -103,13 +204,65 @@ async def chat_with_model_api(request: ChatRequest):
         logger.error(f"Ошибка при общении с моделью: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при общении с моделью")
 
+def _sse(event, data):
+    """
+    Форматирует событие Server-Sent Events с данными в JSON.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_with_model_stream_api(request: ChatRequest):
+    """
+    Общение с моделью через API с потоковой передачей ответа (Server-Sent Events).
+
+    События: "token" — очередной фрагмент ответа, "done" — источники и теги найденных
+    документов, "error" — ошибка генерации.
+    """
+    events = stream_chat_with_model(
+        query=request.query,
+        context=request.context,
+        tag=request.tag,
+        config=config,
+        log_func=logger.info
+    )
+
+    def close_events(pending):
+        # Генератор закрывается только после завершения выполняющегося next()
+        if not pending.cancelled():
+            pending.exception()
+        get_executor("llm").submit(events.close)
+
+    async def event_stream():
+        # Генератор синхронный: каждый следующий фрагмент запрашивается в пуле llm
+        pending = None
+        try:
+            while True:
+                pending = asyncio.ensure_future(run_in_executor("llm", next, events, None))
+                # При отключении клиента отменяется ожидание, но не сам запрос фрагмента
+                item = await asyncio.shield(pending)
+                pending = None
+                if item is None:
+                    break
+                yield _sse(item["event"], item["data"])
+        except Exception as e:
+            logger.error(f"Ошибка при общении с моделью: {e}")
+            yield _sse("error", {"detail": "Ошибка при общении с моделью"})
+        finally:
+            if pending is None or pending.done():
+                events.close()
+            else:
+                pending.add_done_callback(close_events)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
 @app.post("/parse-links")
 async def parse_links_api(request: ParseLinksRequest):
     """
     Парсинг ссылок с веб-страницы и сохранение их в файл urlslist.txt.
     """
     try:
-        parse_and_save_urls(
+        await run_in_executor(
+            "ingest", parse_and_save_urls,
             base_url=request.base_url,
             tag=request.tag,
             username=request.username,
@@ -128,12 +281,20 @@ async def add_urls_from_file_api(request: AddUrlsFromFileRequest):
     Добавление URL из файла urlslist.txt в векторное хранилище через API.
     """
     try:
-        add_urls_from_file(
+        result = await run_in_executor(
+            "ingest", add_urls_from_file,
             file_path=request.url_list_path,
             config=config,
-            log_func=logger.info
+            log_func=logger.info,
+            force=request.force,
+            concurrency=request.concurrency
         )
-        return {"message": f"URL из файла '{request.url_list_path}' успешно добавлены в векторное хранилище."}
+        return {
+            "message": f"URL из файла '{request.url_list_path}' успешно добавлены в векторное хранилище.",
+            "added": result["added"],
+            "skipped": result["skipped"],
+            "stages": result["stages"],
+        }
     except Exception as e:
         logger.error(f"Ошибка при добавлении URL из файла: {e}")
         raise HTTPException(status_code=500, detail="Ошибка при добавлении URL из файла")
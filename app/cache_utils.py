@@ -0,0 +1,488 @@
+# app/cache_utils.py
+
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+
+def text_hash(text):
+    """
+    Возвращает SHA-256 хэш текста.
+
+    Args:
+        text (str): Исходный текст.
+
+    Returns:
+        str: Хэш в шестнадцатеричном виде.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Постоянный кэш эмбеддингов в SQLite с вытеснением давно не использованных записей.
+
+    Ключ записи — (модель эмбеддингов, размерность, хэш текста).
+    """
+
+    def __init__(self, path, max_entries=200000):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                dimensionality INTEGER NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (model, dimensionality, text_hash)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_access ON embeddings (last_access)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def get_many(self, model, dimensionality, hashes):
+        """
+        Возвращает найденные в кэше эмбеддинги и обновляет время обращения к ним.
+
+        Args:
+            model (str): Модель эмбеддингов.
+            dimensionality (int): Размерность эмбеддингов (0 — размерность модели).
+            hashes (list): Хэши текстов.
+
+        Returns:
+            dict: Отображение хэш -> эмбеддинг для найденных записей.
+        """
+        found = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        now = time.time()
+        with self._lock:
+            # Ограничение SQLite на число параметров запроса
+            for start in range(0, len(unique_hashes), 500):
+                batch = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND dimensionality = ? AND text_hash IN ({placeholders})",
+                    (model, dimensionality, *batch)
+                ).fetchall()
+                for row_hash, blob in rows:
+                    found[row_hash] = array("f", blob).tolist()
+                if rows:
+                    # Обновляются только найденные записи: параметров столько же, сколько строк
+                    found_placeholders = ",".join("?" * len(rows))
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_access = ? "
+                        f"WHERE model = ? AND dimensionality = ? AND text_hash IN ({found_placeholders})",
+                        (now, model, dimensionality, *[row[0] for row in rows])
+                    )
+            self._conn.commit()
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model, dimensionality, items):
+        """
+        Сохраняет эмбеддинги в кэш и вытесняет старые записи при превышении лимита.
+
+        Args:
+            model (str): Модель эмбеддингов.
+            dimensionality (int): Размерность эмбеддингов (0 — размерность модели).
+            items (dict): Отображение хэш -> эмбеддинг.
+        """
+        now = time.time()
+        with self._lock:
+            for row_hash, vector in items.items():
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO embeddings "
+                    "(model, dimensionality, text_hash, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+                    (model, dimensionality, row_hash, array("f", vector).tobytes(), now)
+                )
+                self._size += cursor.rowcount
+            if self._size > self.max_entries:
+                overflow = self._size - self.max_entries
+                cursor = self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+                    (overflow,)
+                )
+                self._size -= cursor.rowcount
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Возвращает счётчики попаданий и промахов кэша.
+
+        Returns:
+            dict: Статистика кэша.
+        """
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def close(self):
+        """
+        Закрывает соединение с файлом кэша.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+def normalize_query(text):
+    """
+    Приводит текст запроса к каноничному виду: нижний регистр и одиночные пробелы.
+
+    Args:
+        text (str): Текст запроса.
+
+    Returns:
+        str: Нормализованный текст.
+    """
+    return " ".join(text.split()).lower()
+
+
+class QueryEmbeddingCache:
+    """
+    Кэш эмбеддингов поисковых запросов в памяти с ограничением по размеру и времени жизни.
+
+    Ключ записи — (модель эмбеддингов, нормализованный текст запроса). При указании
+    persist_path содержимое сохраняется в JSON при закрытии и загружается при создании.
+    """
+
+    def __init__(self, max_entries=2048, ttl_seconds=3600, persist_path=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        if persist_path and os.path.exists(persist_path):
+            self._load()
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds and now - created_at > self.ttl_seconds
+
+    def get(self, model, text):
+        """
+        Возвращает эмбеддинг запроса из кэша или None.
+
+        Args:
+            model (str): Модель эмбеддингов.
+            text (str): Текст запроса.
+
+        Returns:
+            list: Эмбеддинг или None при промахе.
+        """
+        key = (model, normalize_query(text))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or self._is_expired(entry[1], now):
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, model, text, vector):
+        """
+        Сохраняет эмбеддинг запроса, вытесняя самые старые записи при переполнении.
+
+        Args:
+            model (str): Модель эмбеддингов.
+            text (str): Текст запроса.
+            vector (list): Эмбеддинг запроса.
+        """
+        key = (model, normalize_query(text))
+        with self._lock:
+            self._entries[key] = (vector, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Возвращает счётчики попаданий и промахов кэша.
+
+        Returns:
+            dict: Статистика кэша.
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    def _load(self):
+        now = time.time()
+        with open(self.persist_path, "r", encoding="utf-8") as f:
+            rows = json.load(f)
+        for model, text, vector, created_at in rows[-self.max_entries:]:
+            if not self._is_expired(created_at, now):
+                self._entries[(model, text)] = (vector, created_at)
+
+    def close(self):
+        """
+        Сохраняет кэш на диск, если указан persist_path.
+        """
+        if not self.persist_path:
+            return
+        directory = os.path.dirname(self.persist_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._lock:
+            rows = [
+                [model, text, vector, created_at]
+                for (model, text), (vector, created_at) in self._entries.items()
+            ]
+        with open(self.persist_path, "w", encoding="utf-8") as f:
+            json.dump(rows, f)
+
+
+def embed_queries(embeddings, texts):
+    """
+    Вычисляет эмбеддинги нескольких поисковых запросов одним вызовом модели, если модель
+    это поддерживает (CachedEmbeddings или NomicEmbeddings), иначе по одному.
+
+    Args:
+        embeddings (Embeddings): Модель эмбеддингов.
+        texts (list): Тексты запросов.
+
+    Returns:
+        list: Эмбеддинги в порядке запросов.
+    """
+    if not texts:
+        return []
+    if isinstance(embeddings, CachedEmbeddings):
+        return embeddings.embed_queries(texts)
+    if hasattr(embeddings, "embed"):
+        # NomicEmbeddings: тот же task_type, что и в embed_query
+        return embeddings.embed(list(texts), task_type="search_query")
+    return [embeddings.embed_query(text) for text in texts]
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обёртка над моделью эмбеддингов: эмбеддинги документов берутся из постоянного
+    кэша, эмбеддинги запросов — из кэша в памяти; модель вызывается только при промахе.
+    """
+
+    def __init__(self, embeddings, cache=None, model="", dimensionality=None, query_cache=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.dimensionality = dimensionality or 0
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts):
+        if self.cache is None:
+            return self.embeddings.embed_documents(texts)
+
+        hashes = [text_hash(text) for text in texts]
+        found = self.cache.get_many(self.model, self.dimensionality, hashes)
+
+        # Каждый уникальный новый текст отправляется в модель один раз
+        missing = {}
+        for row_hash, text in zip(hashes, texts):
+            if row_hash not in found and row_hash not in missing:
+                missing[row_hash] = text
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model, self.dimensionality, computed)
+            found.update(computed)
+
+        return [found[row_hash] for row_hash in hashes]
+
+    def embed_query(self, text):
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+
+        vector = self.query_cache.get(self.model, text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.query_cache.put(self.model, text, vector)
+        return vector
+
+    def embed_queries(self, texts):
+        """
+        Возвращает эмбеддинги нескольких запросов; промахи кэша запросов вычисляются
+        одним вызовом модели.
+
+        Args:
+            texts (list): Тексты запросов.
+
+        Returns:
+            list: Эмбеддинги в порядке запросов.
+        """
+        if self.query_cache is None:
+            return embed_queries(self.embeddings, texts)
+
+        vectors = [self.query_cache.get(self.model, text) for text in texts]
+        missing = {}
+        for text, vector in zip(texts, vectors):
+            if vector is None:
+                missing.setdefault(normalize_query(text), text)
+
+        if missing:
+            computed = dict(zip(missing.keys(), embed_queries(self.embeddings, list(missing.values()))))
+            for key, text in missing.items():
+                self.query_cache.put(self.model, text, computed[key])
+            vectors = [
+                vector if vector is not None else computed[normalize_query(text)]
+                for text, vector in zip(texts, vectors)
+            ]
+        return vectors
+
+
+def _normalize_vector(vector):
+    norm = math.sqrt(sum(value * value for value in vector))
+    if not norm:
+        return list(vector)
+    return [value / norm for value in vector]
+
+
+class AnswerCache:
+    """
+    Семантический кэш ответов модели в памяти.
+
+    Записи сгруппированы по ключу (тег, модель, дополнительный контекст); внутри группы
+    ответ возвращается, если косинусное сходство эмбеддинга нового запроса с сохранённым
+    не ниже similarity_threshold. Запись считается устаревшей по истечении ttl_seconds
+    или если источники её тега перезагружались после её создания.
+    """
+
+    def __init__(self, similarity_threshold=0.95, max_entries=512, ttl_seconds=3600):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._lock = threading.Lock()
+        self._counter = 0
+        # Ключ записи -> (ключ группы, нормализованный эмбеддинг, ответ, время создания)
+        self._entries = OrderedDict()
+
+    def _is_expired(self, created_at, now):
+        return self.ttl_seconds and now - created_at > self.ttl_seconds
+
+    def get(self, group, vector, fresh_after=None):
+        """
+        Возвращает сохранённый ответ на наиболее похожий запрос группы или None.
+
+        Args:
+            group (tuple): Ключ группы (тег, модель, контекст).
+            vector (list): Эмбеддинг запроса.
+            fresh_after (float, optional): Время последней загрузки источников тега;
+                более ранние записи считаются устаревшими.
+
+        Returns:
+            str: Ответ или None при промахе.
+        """
+        vector = _normalize_vector(vector)
+        now = time.time()
+        with self._lock:
+            best_key, best_similarity = None, -1.0
+            for key, (entry_group, entry_vector, _, created_at) in list(self._entries.items()):
+                if entry_group != group:
+                    continue
+                if self._is_expired(created_at, now) or (fresh_after and created_at < fresh_after):
+                    del self._entries[key]
+                    self.stale += 1
+                    continue
+                similarity = sum(a * b for a, b in zip(vector, entry_vector))
+                if similarity > best_similarity:
+                    best_key, best_similarity = key, similarity
+
+            if best_key is None or best_similarity < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key][2]
+
+    def put(self, group, vector, answer):
+        """
+        Сохраняет ответ, вытесняя давно не использованные записи при переполнении.
+
+        Args:
+            group (tuple): Ключ группы (тег, модель, контекст).
+            vector (list): Эмбеддинг запроса.
+            answer (str): Ответ модели.
+        """
+        with self._lock:
+            self._counter += 1
+            self._entries[self._counter] = (group, _normalize_vector(vector), answer, time.time())
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tag=None):
+        """
+        Удаляет записи, зависящие от тега: записи самого тега и поиска по всем тегам.
+        Без тега очищает кэш полностью.
+
+        Args:
+            tag (str, optional): Тег перезагруженных источников.
+        """
+        with self._lock:
+            if tag is None:
+                self._entries.clear()
+                return
+            for key, (group, _, _, _) in list(self._entries.items()):
+                group_tag = group[0]
+                if group_tag == tag or (group_tag and group_tag.lower() == "all"):
+                    del self._entries[key]
+
+    def stats(self):
+        """
+        Возвращает счётчики попаданий, промахов и устаревших записей кэша.
+
+        Returns:
+            dict: Статистика кэша.
+        """
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "similarity_threshold": self.similarity_threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -1,44 +1,145 @@
-import subprocess
-import requests
-from langchain_ollama import ChatOllama
+from dataclasses import dataclass
 from langchain_core.messages import HumanMessage, SystemMessage
-from app.search_utils import search_documents
+from app.context_utils import build_context, context_window, count_tokens
+from app.rerank_utils import search_and_rerank
+from app.ollama_utils import get_ollama_monitor, get_chat_model
+from app.store_utils import get_embeddings, get_answer_cache, get_manifest
 
 
-def ensure_ollama_running(log_func=None):
+def ensure_ollama_running(log_func=None, config=None):
     """
     Проверяет, запущен ли сервер Ollama. Если нет, запускает его.
+
+    Используется последнее состояние общего монитора сервера, поэтому при доступном
+    сервере сетевой проверки не выполняется.
     """
-    try:
-        response = requests.get("http://127.0.0.1:11434/health", timeout=5)
-        if response.status_code == 200:
-            if log_func:
-                log_func("Сервер Ollama уже запущен.")
-            return True
-    except requests.ConnectionError:
-        if log_func:
-            log_func("Сервер Ollama не запущен. Попытка запуска...")
+    return get_ollama_monitor(config, log_func).ensure_running()
+
+
+def format_sources(search_results):
+    """
+    Формирует список источников и тегов найденных документов для вывода после ответа.
+
+    Args:
+        search_results (list): Результаты поиска.
+
+    Returns:
+        str: Строки вида "source: ...\ntag: ..." для каждого документа.
+    """
+    return "\n".join([f"source: {doc['metadata'].get('source', 'N/A')}\ntag: {doc['metadata'].get('tag', 'N/A')}" for doc in search_results])
+
+
+@dataclass
+class PreparedChat:
+    """
+    Подготовленный запрос к модели.
+    """
+    messages: list = None
+    search_results: list = None
+    answer: str = None  # готовый ответ, если модель вызывать не нужно
+    num_ctx: int = None
 
-    try:
-        subprocess.Popen(["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if log_func:
-            log_func("Сервер Ollama успешно запущен.")
-        return True
-    except Exception as e:
-        if log_func:
-            log_func(f"Не удалось запустить сервер Ollama: {e}")
-        raise RuntimeError("Не удалось запустить сервер Ollama") from e
 
+SYSTEM_PROMPT = (
+    "You are an AI assistant. Answer the question clearly and concisely in Russian. "
+    "Use provided context if available."
+)
 
-def chat_with_model(query, context=None, tag=None, model="llama3.2:1b-instruct-fp16", temperature=0.7, config=None, log_func=None):
+
+def prepare_chat(query, context=None, tag=None, model=None, config=None, log_func=None):
+    """
+    Выполняет поиск по тегу (с переранжированием, если оно включено) и формирует
+    сообщения для модели.
+
+    Найденные части документов укладываются в бюджет токенов (rag.context_tokens, но не
+    больше, чем помещается в контекст модели вместе с ответом), а num_ctx подбирается
+    под итоговый размер запроса.
+
+    Args:
+        query (str): Вопрос пользователя.
+        context (str, optional): Дополнительный контекст для модели.
+        tag (str, optional): Тег для фильтрации документов в базе данных.
+        model (str, optional): Название модели (для размера контекста).
+        config (Config, optional): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+
+    Returns:
+        PreparedChat: Сообщения, использованные результаты поиска и num_ctx
+            или готовый ответ (например, если тег не найден).
+    """
+    # Если указан тег, ищем документы
+    search_results = None
+    if tag:
+        search_results = search_and_rerank(query=query, tag=tag, config=config, log_func=log_func)
+        if tag.lower() != "all" and not search_results:
+            return PreparedChat(answer=f"Тег '{tag}' не найден в базе данных.")
+
+    # Составляем полный запрос без документов
+    full_context = ""
+    if context:
+        full_context += f"Context: {context}\n"
+    if tag:
+        full_context += f"Tag: {tag}\n"
+    question = f"Question: {query}"
+
+    rag = config.rag
+    model_context_size = rag.model_context_sizes.get(model, rag.default_context_size)
+    base_tokens = count_tokens(SYSTEM_PROMPT) + count_tokens(full_context) + count_tokens(question)
+
+    # Формируем контекст из поиска в пределах бюджета токенов
+    search_context = ""
+    context_tokens = 0
+    if search_results:
+        budget = min(rag.context_tokens, model_context_size - rag.answer_tokens - base_tokens)
+        search_context, context_tokens, search_results = build_context(
+            search_results, max(0, budget), log_func=log_func
+        )
+    if search_context:
+        full_context += f"Documents:\n{search_context}\n"
+    full_query = f"{full_context}{question}"
+
+    if log_func:
+        log_func(f"Полный запрос к модели:\n{full_query}")
+
+    messages = [
+        SystemMessage(content=SYSTEM_PROMPT),
+        HumanMessage(content=full_query)
+    ]
+    num_ctx = context_window(base_tokens + context_tokens, rag.answer_tokens, model_context_size)
+    return PreparedChat(messages=messages, search_results=search_results, num_ctx=num_ctx)
+
+
+def _cached_answer_lookup(query, context, tag, model, config, log_func=None):
+    """
+    Ищет в семантическом кэше ответ на похожий запрос с тем же тегом, моделью и контекстом.
+
+    Returns:
+        tuple: (ответ или None, функция сохранения ответа в кэш или None).
+    """
+    if not config.answer_cache.enabled:
+        return None, None
+
+    cache = get_answer_cache(config)
+    group = (tag or "", model, context or "")
+    vector = get_embeddings(config).embed_query(query)
+    answer = cache.get(group, vector, fresh_after=get_manifest(config).tag_updated_at(tag))
+    if answer is not None and log_func:
+        log_func(f"Ответ найден в кэше ответов для запроса: {query}")
+    return answer, lambda response: cache.put(group, vector, response)
+
+
+def chat_with_model(query, context=None, tag=None, model=None, temperature=0.7, config=None, log_func=None):
     """
     Отправляет запрос к модели чатбота и возвращает ответ.
 
+    Если включён кэш ответов (answer_cache), ответ на достаточно похожий запрос с тем
+    же тегом, моделью и контекстом возвращается без поиска и генерации.
+
     Args:
         query (str): Вопрос пользователя.
         context (str, optional): Дополнительный контекст для модели.
         tag (str, optional): Тег для фильтрации документов в базе данных.
-        model (str): Название модели (по умолчанию из конфигурации).
+        model (str, optional): Название модели (по умолчанию ollama.default_model).
         temperature (float): Температура для генерации ответа.
         config (Config, optional): Конфигурационный объект.
         log_func (callable, optional): Функция для логирования.
@@ -47,42 +148,22 @@ def chat_with_model(query, context=None, tag=None, model="llama3.2:1b-instruct-f
         str: Ответ модели и метаданные при наличии поиска.
     """
     try:
-        ensure_ollama_running(log_func)
+        ensure_ollama_running(log_func, config)
 
+        model = model or config.ollama.default_model
         if log_func:
             log_func(f"Инициализация модели: {model}")
 
-        # Если указан тег, ищем документы
-        search_results = None
-        if tag:
-            search_results = search_documents(query=query, tag=tag, config=config, log_func=log_func)
-            if tag.lower() != "all" and not search_results:
-                return f"Тег '{tag}' не найден в базе данных."
+        cached_answer, store_answer = _cached_answer_lookup(query, context, tag, model, config, log_func)
+        if cached_answer is not None:
+            return cached_answer
 
-        # Формируем контекст из поиска, если есть результаты
-        search_context = "\n\n".join([doc['content'] for doc in search_results]) if search_results else ""
+        prepared = prepare_chat(query, context, tag, model, config, log_func)
+        if prepared.answer is not None:
+            return prepared.answer
+        messages, search_results = prepared.messages, prepared.search_results
 
-        # Составляем полный запрос
-        full_context = ""
-        if context:
-            full_context += f"Context: {context}\n"
-        if tag:
-            full_context += f"Tag: {tag}\n"
-        full_query = f"{full_context}Question: {query}"
-
-        if log_func:
-            log_func(f"Полный запрос к модели:\n{full_query}")
-
-        llm = ChatOllama(model=model, temperature=temperature)
-
-        system_prompt = (
-            "You are an AI assistant. Answer the question clearly and concisely in Russian. "
-            "Use provided context if available."
-        )
-        messages = [
-            SystemMessage(content=system_prompt),
-            HumanMessage(content=full_query)
-        ]
+        llm = get_chat_model(config, model=model, temperature=temperature, num_ctx=prepared.num_ctx)
 
         if log_func:
             log_func(f"Отправка сообщений в модель: {messages}")
@@ -95,12 +176,79 @@ def chat_with_model(query, context=None, tag=None, model="llama3.2:1b-instruct-f
 
         # Форматируем ответ
         if search_results:
-            metadata_info = "\n".join([f"source: {doc['metadata'].get('source', 'N/A')}\ntag: {doc['metadata'].get('tag', 'N/A')}" for doc in search_results])
-            return f"{response_text}\n\n{metadata_info}"
+            metadata_info = format_sources(search_results)
+            response_text = f"{response_text}\n\n{metadata_info}"
 
+        if store_answer is not None:
+            store_answer(response_text)
         return response_text
 
     except Exception as e:
         if log_func:
             log_func(f"Ошибка при взаимодействии с моделью: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+
+def stream_chat_with_model(query, context=None, tag=None, model=None, temperature=0.7, config=None, log_func=None):
+    """
+    Отправляет запрос к модели чатбота и отдаёт ответ по частям по мере генерации.
+
+    Args:
+        query (str): Вопрос пользователя.
+        context (str, optional): Дополнительный контекст для модели.
+        tag (str, optional): Тег для фильтрации документов в базе данных.
+        model (str, optional): Название модели (по умолчанию ollama.default_model).
+        temperature (float): Температура для генерации ответа.
+        config (Config, optional): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+
+    Yields:
+        dict: События {"event": "token", "data": str} для каждого фрагмента ответа и
+            последнее событие {"event": "done", "data": {...}} с источниками и тегами
+            найденных документов.
+    """
+    try:
+        ensure_ollama_running(log_func, config)
+
+        model = model or config.ollama.default_model
+        if log_func:
+            log_func(f"Инициализация модели: {model}")
+
+        prepared = prepare_chat(query, context, tag, model, config, log_func)
+        if prepared.answer is not None:
+            yield {"event": "token", "data": prepared.answer}
+            yield {"event": "done", "data": {"sources": [], "metadata": ""}}
+            return
+        messages, search_results = prepared.messages, prepared.search_results
+
+        llm = get_chat_model(config, model=model, temperature=temperature, num_ctx=prepared.num_ctx)
+
+        if log_func:
+            log_func(f"Потоковая отправка сообщений в модель: {messages}")
+
+        # При закрытии генератора (отключение клиента) закрывается и поток ответа Ollama
+        stream = llm.stream(messages)
+        try:
+            for chunk in stream:
+                token = chunk.content if hasattr(chunk, 'content') else str(chunk)
+                if token:
+                    yield {"event": "token", "data": token}
+        finally:
+            stream.close()
+
+        search_results = search_results or []
+        yield {
+            "event": "done",
+            "data": {
+                "sources": [
+                    {"source": doc['metadata'].get('source', 'N/A'), "tag": doc['metadata'].get('tag', 'N/A')}
+                    for doc in search_results
+                ],
+                "metadata": format_sources(search_results),
+            },
+        }
+
+    except Exception as e:
+        if log_func:
+            log_func(f"Ошибка при взаимодействии с моделью: {e}")
+        raise e
@@ -1,13 +1,12 @@
 # cli.py
 
+import time
 import click
 from app.config import Config
 from app.logger import setup_logger
-from app.search_utils import search_documents
-from app.document_utils import add_document_to_store
-from app.chat_utils import chat_with_model
-from app.urlparser_utils import parse_and_save_urls
-from app.urlslistaddbd_utils import add_urls_from_file as add_urls_from_file_util  # Переименованный импорт
+
+# Модули с LangChain, Chroma и моделями импортируются внутри команд,
+# чтобы --help и лёгкие команды (parse-links) запускались без их загрузки.
 
 @click.group()
 def cli():
@@ -18,11 +17,15 @@ def cli():
 @click.option('--interactive', is_flag=True, help='Запустить в интерактивном режиме.')
 @click.option('--source', default=None, help='Путь до файла или URL источника.')
 @click.option('--tag', default=None, help='Тег для документа.')
-def add_document(interactive, source, tag):
+@click.option('--force', is_flag=True, help='Перезагрузить источник, даже если он не изменился.')
+def add_document(interactive, source, tag, force):
     """
     Добавляет новый документ в векторное хранилище из файла или URL с указанным тегом.
     Если источник уже существует, старая запись будет удалена.
+    Неизменившийся источник пропускается, если не указан --force.
     """
+    from app.document_utils import add_document_to_store
+
     config = Config.load("config.yaml")
     logger = setup_logger(config)
 
@@ -36,42 +39,107 @@ def add_document(interactive, source, tag):
         return
 
     try:
-        add_document_to_store(
+        added = add_document_to_store(
             source=source,
             tag=tag.strip(),
             config=config,
-            log_func=logger.info
+            log_func=logger.info,
+            force=force
         )
-        click.echo(f"Документ '{source}' успешно добавлен с тегом: {tag}.")
+        if added:
+            click.echo(f"Документ '{source}' успешно добавлен с тегом: {tag}.")
+        else:
+            click.echo(f"Документ '{source}' не изменился, повторная загрузка не требуется.")
     except Exception as e:
         logger.error(f"Ошибка при добавлении документа: {e}")
         click.echo(f"Ошибка при добавлении документа: {e}")
 
+def read_queries_file(file_path, default_tag=None):
+    """
+    Читает запросы из файла: по одному на строку, тег (опционально) отделяется табуляцией.
+
+    Args:
+        file_path (str): Путь к файлу с запросами.
+        default_tag (str, optional): Тег для строк без тега.
+
+    Returns:
+        list: Запросы в формате {"query": str, "tag": str или None}.
+    """
+    queries = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line.strip():
+                continue
+            query, _, tag = line.partition("\t")
+            queries.append({"query": query.strip(), "tag": tag.strip() or default_tag})
+    return queries
+
+def echo_results(results):
+    """
+    Выводит результаты поиска.
+    """
+    click.echo(f"Найдено {len(results)} результат(ов):")
+    for i, doc in enumerate(results, start=1):
+        click.echo(f"\nРезультат {i}:")
+        click.echo(f"Содержимое: {doc['content'][:200]}...")
+        click.echo(f"Метаданные: {doc['metadata']}")
+        if doc.get("distance") is not None:
+            click.echo(f"Расстояние: {doc['distance']:.4f}")
+        if doc.get("score") is not None:
+            click.echo(f"Оценка RRF: {doc['score']:.4f}")
+        click.echo("---")
+
 @cli.command()
-@click.option('--query', prompt='Поисковой запрос', help='Поисковой запрос для векторного хранилища.')
+@click.option('--query', default=None, help='Поисковой запрос для векторного хранилища.')
 @click.option('--tag', default=None, help='Фильтр по тегу (опционально).')
-def search(query, tag):
+@click.option('--queries-file', default=None, help='Файл с запросами (по одному на строку, тег через табуляцию) для пакетного поиска.')
+@click.option('--k', 'k', default=None, type=int, help='Количество результатов (по умолчанию из конфигурации).')
+@click.option('--max-distance', default=None, type=float, help='Отбросить результаты с расстоянием больше указанного.')
+@click.option('--mmr/--no-mmr', default=None, help='Диверсифицировать результаты по MMR.')
+@click.option('--fetch-k', default=None, type=int, help='Количество кандидатов для MMR.')
+@click.option('--mmr-lambda', default=None, type=float, help='Баланс релевантности (1) и разнообразия (0) для MMR.')
+@click.option('--mode', default=None, type=click.Choice(['vector', 'hybrid']), help='Режим поиска (по умолчанию из конфигурации).')
+def search(query, tag, queries_file, k, max_distance, mmr, fetch_k, mmr_lambda, mode):
     """
     Ищет документы в векторном хранилище по запросу и опционально по тегу.
+    С --queries-file выполняет все запросы из файла одним пакетом.
     """
+    from app.search_utils import search_documents, search_documents_batch
+
     config = Config.load("config.yaml")
     logger = setup_logger(config)
+    options = {"k": k, "max_distance": max_distance, "mmr": mmr, "fetch_k": fetch_k, "mmr_lambda": mmr_lambda, "mode": mode}
 
     try:
+        if queries_file:
+            queries = read_queries_file(queries_file, default_tag=tag)
+            batch_results = search_documents_batch(
+                queries=queries,
+                config=config,
+                log_func=logger.info,
+                **options
+            )
+            for item, results in zip(queries, batch_results):
+                click.echo(f"\n=== Запрос: {item['query']} (тег: {item['tag'] or 'нет'}) ===")
+                if results:
+                    echo_results(results)
+                else:
+                    click.echo("Результаты поиска не найдены.")
+            return
+
+        if not query:
+            query = click.prompt("Поисковой запрос")
         results = search_documents(
             query=query,
             tag=tag,
             config=config,
-            log_func=logger.info
+            log_func=logger.info,
+            **options
         )
 
         if results:
-            click.echo(f"Найдено {len(results)} результат(ов):")
-            for i, doc in enumerate(results, start=1):
-                click.echo(f"\nРезультат {i}:")
-                click.echo(f"Содержимое: {doc['content'][:200]}...")
-                click.echo(f"Метаданные: {doc['metadata']}")
-                click.echo("---")
+            echo_results(results)
         else:
             click.echo("Результаты поиска не найдены.")
             logger.info("Результаты поиска не найдены.")
@@ -83,14 +151,33 @@ def search(query, tag):
 @click.option('--query', prompt='Вопрос', help='Вопрос для чатбота.')
 @click.option('--context', default=None, help='Контекст для модели (опционально).')
 @click.option('--tag', default=None, help='Тег для поиска (или "all" для поиска по всей базе).')
-def chat(query, context, tag):
+@click.option('--stream', is_flag=True, help='Выводить ответ по мере генерации.')
+def chat(query, context, tag, stream):
     """
     Отправляет вопрос к модели чатбота с указанным контекстом и/или тегом.
     """
+    from app.chat_utils import chat_with_model, stream_chat_with_model
+
     config = Config.load("config.yaml")
     logger = setup_logger(config)
 
     try:
+        if stream:
+            click.echo("Ответ: ", nl=False)
+            for item in stream_chat_with_model(
+                query=query,
+                context=context,
+                tag=tag,
+                config=config,
+                log_func=logger.info
+            ):
+                if item["event"] == "token":
+                    click.echo(item["data"], nl=False)
+                elif item["data"]["metadata"]:
+                    click.echo(f"\n\n{item['data']['metadata']}", nl=False)
+            click.echo()
+            return
+
         response = chat_with_model(
             query=query,
             context=context,
@@ -103,6 +190,56 @@ def chat(query, context, tag):
         logger.error(f"Ошибка при общении с моделью: {e}")
         click.echo(f"Ошибка при общении с моделью: {e}")
 
+@cli.command()
+@click.option('--query', prompt='Поисковой запрос', help='Запрос для замера.')
+@click.option('--tag', default=None, help='Фильтр по тегу (опционально).')
+@click.option('--candidates', default=None, type=int, help='Количество кандидатов (по умолчанию rerank.candidates).')
+@click.option('--top-n', default=None, type=int, help='Количество результатов после переранжирования (по умолчанию rerank.top_n).')
+@click.option('--runs', default=5, type=int, help='Количество повторов замера.')
+def benchmark_rerank(query, tag, candidates, top_n, runs):
+    """
+    Замеряет время поиска и переранжирования и размер контекста для модели
+    с переранжированием и без него.
+    """
+    from app.search_utils import search_documents
+    from app.context_utils import build_context
+    from app.rerank_utils import get_reranker
+
+    config = Config.load("config.yaml")
+    logger = setup_logger(config)
+    candidates = candidates or config.rerank.candidates
+    top_n = top_n or config.rerank.top_n
+    budget = config.rag.context_tokens
+
+    try:
+        reranker = get_reranker(config)
+        # Без бюджета задержки: замеряется полное переранжирование
+        reranker.latency_budget_ms = 0
+        search_times, rerank_times = [], []
+        for _ in range(max(1, runs)):
+            started = time.perf_counter()
+            results = search_documents(query=query, tag=tag, config=config, k=candidates)
+            search_times.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            reranked = reranker.rerank(query, results, top_n)
+            rerank_times.append(time.perf_counter() - started)
+
+        _, tokens_all, used_all = build_context(results, budget)
+        _, tokens_top, used_top = build_context(reranked, budget)
+        # Первый прогон включает загрузку модели
+        steady = rerank_times[1:] or rerank_times
+        click.echo(f"Кандидатов: {len(results)}, после переранжирования: {len(reranked)}")
+        click.echo(f"Поиск: {1000 * sum(search_times) / len(search_times):.1f} мс в среднем")
+        click.echo(
+            f"Переранжирование: {1000 * sum(steady) / len(steady):.1f} мс в среднем "
+            f"(первый прогон с загрузкой модели: {1000 * rerank_times[0]:.1f} мс)"
+        )
+        click.echo(f"Контекст без переранжирования: {tokens_all} токенов, {len(used_all)} частей")
+        click.echo(f"Контекст с переранжированием: {tokens_top} токенов, {len(used_top)} частей")
+    except Exception as e:
+        logger.error(f"Ошибка при замере переранжирования: {e}")
+        click.echo(f"Ошибка при замере переранжирования: {e}")
+
 @cli.command()
 @click.option('--base-url', prompt='URL страницы', help='Базовый URL для парсинга ссылок.')
 @click.option('--tag', prompt='Тег для ссылок', help='Тег для найденных ссылок.')
@@ -112,6 +249,8 @@ def parse_links(base_url, tag, username, password):
     """
     Парсит ссылки с указанной страницы и сохраняет их в файл.
     """
+    from app.urlparser_utils import parse_and_save_urls
+
     config = Config.load("config.yaml")
     logger = setup_logger(config)
 
@@ -133,20 +272,27 @@ def parse_links(base_url, tag, username, password):
 @click.option('--url-list-path', default="urlslist.txt", help='Путь к файлу со списком URL (по умолчанию "urlslist.txt").')
 @click.option('--username', default=None, help='Логин для авторизации (опционально).')
 @click.option('--password', default=None, help='Пароль для авторизации (опционально).')
-def add_urls_from_file(url_list_path, username, password):
+@click.option('--force', is_flag=True, help='Перезагрузить все источники, даже если они не изменились.')
+@click.option('--concurrency', default=None, type=int, help='Количество потоков загрузки (по умолчанию из конфигурации).')
+def add_urls_from_file(url_list_path, username, password, force, concurrency):
     """
     Добавляет URL из файла в векторное хранилище.
     """
+    from app.urlslistaddbd_utils import add_urls_from_file as add_urls_from_file_util  # Переименованный импорт
+
     config = Config.load("config.yaml")
     logger = setup_logger(config)
 
     try:
-        add_urls_from_file_util(
+        result = add_urls_from_file_util(
             file_path=url_list_path,  # Исправление аргумента
             config=config,
-            log_func=logger.info
+            log_func=logger.info,
+            force=force,
+            concurrency=concurrency
         )
         click.echo(f"URL из файла '{url_list_path}' успешно добавлены в векторное хранилище.")
+        click.echo(f"Загружено: {result['added']}, без изменений: {result['skipped']}.")
     except Exception as e:
         logger.error(f"Ошибка при добавлении URL из файла: {e}")
         click.echo(f"Ошибка при добавлении URL из файла: {e}")
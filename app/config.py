@@ -1,18 +1,94 @@
 # app/config.py
 
 import yaml
-from dataclasses import dataclass
-from typing import Dict
+from dataclasses import dataclass, field
+from typing import Dict, Optional, Union
 
 @dataclass
 class VectorDBConfig:
     persist_directory: str
     embedding_model: str
     inference_mode: str
+    dimensionality: Optional[int] = None
+    partition_by_tag: bool = False
+    scatter_workers: int = 4
+
+@dataclass
+class EmbeddingCacheConfig:
+    enabled: bool = True
+    path: str = "./cache/embeddings.sqlite3"
+    max_entries: int = 200000
+
+@dataclass
+class QueryCacheConfig:
+    enabled: bool = True
+    max_entries: int = 2048
+    ttl_seconds: int = 3600
+    persist_path: Optional[str] = None
+
+@dataclass
+class AnswerCacheConfig:
+    enabled: bool = True
+    similarity_threshold: float = 0.95
+    max_entries: int = 512
+    ttl_seconds: int = 3600
+
+@dataclass
+class IngestConfig:
+    chunk_size: int = 1000
+    chunk_overlap: int = 200
+    split_workers: int = 1
+    parallel_split_min_documents: int = 32
+    batch_size: int = 64
+    embed_workers: int = 2
+    max_in_flight: int = 4
+    fetch_concurrency: int = 4
+    per_host_concurrency: int = 2
+    queue_size: int = 256
+
+@dataclass
+class ExecutorsConfig:
+    search_workers: int = 4
+    llm_workers: int = 2
+    ingest_workers: int = 1
+    max_queue: int = 32
 
 @dataclass
 class OllamaConfig:
     default_model: str
+    base_url: str = "http://127.0.0.1:11434"
+    health_interval: float = 10.0
+    startup_timeout: float = 15.0
+    keep_alive: Union[str, int] = "30m"
+    warm_up_timeout: float = 300.0
+
+@dataclass
+class SearchConfig:
+    k: int = 10
+    max_distance: Optional[float] = None
+    mmr: bool = False
+    fetch_k: int = 20
+    mmr_lambda: float = 0.5
+    mode: str = "vector"
+    hybrid_candidates: int = 20
+    rrf_k: int = 60
+
+@dataclass
+class RerankConfig:
+    enabled: bool = False
+    model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    candidates: int = 30
+    top_n: int = 5
+    batch_size: int = 16
+    max_length: int = 512
+    latency_budget_ms: float = 300.0
+
+@dataclass
+class RagConfig:
+    context_tokens: int = 2048
+    answer_tokens: int = 512
+    default_context_size: int = 4096
+    model_context_sizes: Dict[str, int] = field(default_factory=dict)
 
 @dataclass
 class LoggingConfig:
@@ -25,6 +101,14 @@ class Config:
     vector_db: VectorDBConfig
     ollama: OllamaConfig
     logging: LoggingConfig
+    embedding_cache: EmbeddingCacheConfig = field(default_factory=EmbeddingCacheConfig)
+    query_cache: QueryCacheConfig = field(default_factory=QueryCacheConfig)
+    answer_cache: AnswerCacheConfig = field(default_factory=AnswerCacheConfig)
+    ingest: IngestConfig = field(default_factory=IngestConfig)
+    executors: ExecutorsConfig = field(default_factory=ExecutorsConfig)
+    search: SearchConfig = field(default_factory=SearchConfig)
+    rerank: RerankConfig = field(default_factory=RerankConfig)
+    rag: RagConfig = field(default_factory=RagConfig)
 
     @classmethod
     def load(cls, filepath: str) -> 'Config':
@@ -35,5 +119,13 @@ class Config:
             user_agent=config_dict.get('user_agent', 'MyStandaloneScript/1.0'),
             vector_db=VectorDBConfig(**config_dict.get('vector_db', {})),
             ollama=OllamaConfig(**config_dict.get('ollama', {})),
-            logging=LoggingConfig(**config_dict.get('logging', {}))
+            logging=LoggingConfig(**config_dict.get('logging', {})),
+            embedding_cache=EmbeddingCacheConfig(**config_dict.get('embedding_cache', {})),
+            query_cache=QueryCacheConfig(**config_dict.get('query_cache', {})),
+            answer_cache=AnswerCacheConfig(**config_dict.get('answer_cache', {})),
+            ingest=IngestConfig(**config_dict.get('ingest', {})),
+            executors=ExecutorsConfig(**config_dict.get('executors', {})),
+            search=SearchConfig(**config_dict.get('search', {})),
+            rerank=RerankConfig(**config_dict.get('rerank', {})),
+            rag=RagConfig(**config_dict.get('rag', {}))
         )
\ No newline at end of file
@@ -0,0 +1,163 @@
+# app/context_utils.py
+
+from functools import lru_cache
+
+import tiktoken
+
+# Минимальная длина совпадения (в символах), при которой соседние части одного
+# источника считаются перекрывающимися
+MIN_OVERLAP_CHARS = 50
+
+# Части короче этого остатка бюджета (в токенах) не обрезаются, а отбрасываются
+MIN_CHUNK_TOKENS = 32
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text):
+    """
+    Оценивает количество токенов в тексте (кодировка cl100k_base, как у разделителя).
+
+    Args:
+        text (str): Текст.
+
+    Returns:
+        int: Количество токенов.
+    """
+    return len(_get_encoding().encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Обрезает текст до заданного количества токенов.
+
+    Args:
+        text (str): Текст.
+        max_tokens (int): Максимальное количество токенов.
+
+    Returns:
+        str: Обрезанный текст.
+    """
+    encoding = _get_encoding()
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def _overlap_length(left, right):
+    """
+    Возвращает длину самого длинного суффикса left, совпадающего с префиксом right.
+    """
+    if len(left) < MIN_OVERLAP_CHARS or len(right) < MIN_OVERLAP_CHARS:
+        return 0
+    probe = right[:MIN_OVERLAP_CHARS]
+    position = left.find(probe)
+    while position != -1:
+        tail = left[position:]
+        if right.startswith(tail):
+            return len(tail)
+        position = left.find(probe, position + 1)
+    return 0
+
+
+def _remove_overlaps(text, accepted):
+    """
+    Убирает из текста фрагменты, уже присутствующие в принятых частях того же источника
+    (перекрытие соседних частей при разбиении).
+    """
+    for other in accepted:
+        if text in other:
+            return ""
+        overlap = _overlap_length(other, text)
+        if overlap:
+            text = text[overlap:]
+        overlap = _overlap_length(text, other)
+        if overlap:
+            text = text[:-overlap]
+    return text.strip()
+
+
+def build_context(search_results, max_tokens, log_func=None):
+    """
+    Собирает контекст для модели из найденных частей документов в пределах бюджета токенов.
+
+    Части берутся в порядке релевантности (по оценке переранжирования или по возрастанию
+    расстояния, если они есть в результатах, иначе в порядке выдачи поиска). Повторы и перекрытия соседних частей
+    одного источника удаляются; последняя не помещающаяся часть обрезается.
+
+    Args:
+        search_results (list): Результаты поиска в формате {content, metadata}.
+        max_tokens (int): Бюджет токенов на контекст.
+        log_func (callable, optional): Функция для логирования.
+
+    Returns:
+        tuple: (текст контекста, количество токенов, использованные результаты).
+    """
+    if all("rerank_score" in doc for doc in search_results):
+        ordered = sorted(search_results, key=lambda doc: doc["rerank_score"], reverse=True)
+    elif all("distance" in doc for doc in search_results):
+        ordered = sorted(search_results, key=lambda doc: doc["distance"])
+    else:
+        ordered = list(search_results)
+
+    parts = []
+    used = []
+    accepted_by_source = {}
+    remaining = max_tokens
+    separator_tokens = count_tokens("\n\n")
+
+    for doc in ordered:
+        source = doc["metadata"].get("source")
+        accepted = accepted_by_source.setdefault(source, [])
+        text = _remove_overlaps(doc["content"].strip(), accepted)
+        if not text:
+            continue
+
+        tokens = count_tokens(text) + (separator_tokens if parts else 0)
+        if tokens > remaining:
+            if remaining < MIN_CHUNK_TOKENS:
+                break
+            text = truncate_to_tokens(text, remaining - separator_tokens)
+            tokens = remaining
+
+        accepted.append(doc["content"])
+        parts.append(text)
+        used.append(doc)
+        remaining -= tokens
+        if remaining <= 0:
+            break
+
+    if log_func:
+        log_func(
+            f"Контекст: {len(used)} из {len(search_results)} частей, "
+            f"{max_tokens - remaining} из {max_tokens} токенов."
+        )
+    return "\n\n".join(parts), max_tokens - remaining, used
+
+
+def context_window(prompt_tokens, answer_tokens, model_context_size, min_context_size=2048):
+    """
+    Подбирает num_ctx для Ollama: наименьшая степень двойки (не меньше min_context_size),
+    вмещающая запрос и ответ, но не больше контекста модели.
+
+    Шаг степенями двойки выбран, чтобы сервер не перезагружал модель из-за
+    небольших изменений num_ctx между запросами.
+
+    Args:
+        prompt_tokens (int): Количество токенов запроса.
+        answer_tokens (int): Резерв токенов на ответ.
+        model_context_size (int): Максимальный контекст модели.
+        min_context_size (int): Минимальный num_ctx.
+
+    Returns:
+        int: Значение num_ctx.
+    """
+    needed = prompt_tokens + answer_tokens
+    size = min_context_size
+    while size < needed:
+        size *= 2
+    return min(size, model_context_size)
@@ -1,63 +1,570 @@
+import atexit
+import multiprocessing
+import os
+import sqlite3
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
+from app.config import IngestConfig
+
+# Общий пул процессов для параллельного разбиения документов
+_split_pool = None
+_split_pool_workers = 0
+_split_pool_lock = threading.Lock()
 
 
-def add_documents_to_db(vectorstore, documents, log_func=None):
+class LexicalIndex:
     """
-    Добавляет новые документы в существующую векторную базу данных с использованием Chroma.
+    Полнотекстовый индекс частей документов (SQLite FTS5, ранжирование BM25), который
+    ведётся рядом с коллекцией Chroma: те же идентификаторы частей, источник и тег.
+
+    Части хранятся в обычной таблице с индексами по источнику и тегу, а FTS5-таблица
+    использует её как внешнее содержимое и синхронизируется триггерами.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                chunk_id TEXT NOT NULL UNIQUE,
+                source TEXT,
+                tag TEXT,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);
+            CREATE INDEX IF NOT EXISTS chunks_tag ON chunks (tag);
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                content, content='chunks', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS chunks_ai AFTER INSERT ON chunks BEGIN
+                INSERT INTO chunks_fts (rowid, content) VALUES (new.id, new.content);
+            END;
+            CREATE TRIGGER IF NOT EXISTS chunks_ad AFTER DELETE ON chunks BEGIN
+                INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            END;
+            """
+        )
+        self._conn.commit()
+
+    def add(self, ids, contents, metadatas):
+        """
+        Добавляет части документов в индекс (записи с теми же идентификаторами заменяются).
+
+        Args:
+            ids (list): Идентификаторы частей в Chroma.
+            contents (list): Тексты частей.
+            metadatas (list): Метаданные частей (используются source и tag).
+        """
+        rows = [
+            (chunk_id, (metadata or {}).get("source"), (metadata or {}).get("tag"), content or "")
+            for chunk_id, content, metadata in zip(ids, contents, metadatas)
+        ]
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(row[0],) for row in rows])
+            self._conn.executemany(
+                "INSERT INTO chunks (chunk_id, source, tag, content) VALUES (?, ?, ?, ?)", rows
+            )
+            self._conn.commit()
+
+    def remove_sources(self, sources):
+        """
+        Удаляет из индекса все части указанных источников.
+
+        Args:
+            sources (iterable): Источники документов.
+        """
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM chunks WHERE source = ?", [(source,) for source in sources]
+            )
+            self._conn.commit()
+
+    def clear(self):
+        """
+        Удаляет все части из индекса.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+    def count(self):
+        """
+        Возвращает количество частей в индексе.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def match_expression(query):
+        """
+        Преобразует текст запроса в выражение FTS5: каждое слово запроса — отдельная
+        фраза в кавычках (так идентификаторы вида ABC-123 ищутся целиком), фразы
+        объединяются через OR.
+
+        Args:
+            query (str): Текст запроса.
+
+        Returns:
+            str: Выражение MATCH или пустая строка, если в запросе нет слов.
+        """
+        terms = [term.replace('"', '""') for term in query.split()]
+        return " OR ".join(f'"{term}"' for term in terms if term.strip('"'))
+
+    def search(self, query, k=10, tag=None):
+        """
+        Ищет части документов по словам запроса с ранжированием BM25.
+
+        Args:
+            query (str): Текст запроса.
+            k (int): Количество результатов.
+            tag (str, optional): Тег для фильтрации (None — без фильтра).
+
+        Returns:
+            list: Пары (идентификатор части, оценка BM25), от лучшей к худшей
+                (в SQLite меньшая оценка bm25 означает большую релевантность).
+        """
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        sql = (
+            "SELECT chunks.chunk_id, bm25(chunks_fts) AS rank FROM chunks_fts "
+            "JOIN chunks ON chunks.id = chunks_fts.rowid WHERE chunks_fts MATCH ?"
+        )
+        params = [expression]
+        if tag is not None:
+            sql += " AND chunks.tag = ?"
+            params.append(tag)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(k)
+        with self._lock:
+            return [(row[0], row[1]) for row in self._conn.execute(sql, params).fetchall()]
+
+    def close(self):
+        """
+        Закрывает соединение с файлом индекса.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+def sync_lexical_index(vectorstore, lexical_index, log_func=None, batch_size=1000):
+    """
+    Перестраивает полнотекстовый индекс по коллекции Chroma, если количество частей
+    в них расходится (например, база была наполнена до появления индекса).
 
     Args:
         vectorstore: Экземпляр векторного хранилища.
-        documents: Список документов для добавления.
+        lexical_index (LexicalIndex): Полнотекстовый индекс.
         log_func (callable, optional): Функция для логирования сообщений.
+        batch_size (int): Количество частей, читаемых из Chroma за один запрос.
+
+    Returns:
+        bool: True, если индекс был перестроен.
     """
+    collections = get_collections(vectorstore)
+    counts = [collection.count() for collection in collections]
+    if lexical_index.count() == sum(counts):
+        return False
+
     if log_func:
-        log_func("Добавление новых документов в векторную базу данных...")
+        log_func(f"Перестроение полнотекстового индекса: {sum(counts)} частей документов.")
+    lexical_index.clear()
+    for collection, total in zip(collections, counts):
+        for offset in range(0, total, batch_size):
+            page = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            lexical_index.add(page["ids"], page["documents"], page["metadatas"])
+    return True
 
-    # Разделение документов на части для векторизации
-    text_splitter = RecursiveCharacterTextSplitter.from_tiktoken_encoder(
-        chunk_size=1000,
-        chunk_overlap=200
+
+def _sanitize_metadata(metadata):
+    """
+    Приводит метаданные к типам, которые принимает Chroma (str, int, float, bool).
+
+    Args:
+        metadata (dict): Исходные метаданные документа.
+
+    Returns:
+        dict: Метаданные без пустых значений и со сложными значениями в виде строк.
+    """
+    return {
+        key: value if isinstance(value, (str, int, float, bool)) else str(value)
+        for key, value in metadata.items()
+        if value is not None
+    }
+
+
+def get_collections(vectorstore):
+    """
+    Возвращает коллекции Chroma хранилища: все разделы для хранилища, разделённого
+    по тегам, или единственную коллекцию.
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+
+    Returns:
+        list: Коллекции Chroma.
+    """
+    if hasattr(vectorstore, "partitions"):
+        return [partition._collection for partition in vectorstore.partitions().values()]
+    return [vectorstore._collection]
+
+
+def count_documents(vectorstore):
+    """
+    Возвращает количество частей документов во всех коллекциях хранилища.
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+
+    Returns:
+        int: Количество частей.
+    """
+    return sum(collection.count() for collection in get_collections(vectorstore))
+
+
+def embed_batches(embeddings, batches, workers=2, max_in_flight=4):
+    """
+    Вычисляет эмбеддинги готовых пачек частей документов в пуле потоков.
+
+    Одновременно в работе находится не более max_in_flight пачек. Пачки возвращаются
+    в исходном порядке вместе с сопровождающими их данными.
+
+    Args:
+        embeddings: Модель эмбеддингов.
+        batches (iterable): Кортежи (пачка частей документов, сопровождающие данные).
+        workers (int): Количество потоков для вычисления эмбеддингов.
+        max_in_flight (int): Максимальное количество пачек в работе.
+
+    Yields:
+        tuple: (пачка частей документов, сопровождающие данные, список эмбеддингов).
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        in_flight = deque()
+        for batch, payload in batches:
+            texts = [split.page_content for split in batch]
+            future = executor.submit(embeddings.embed_documents, texts) if texts else None
+            in_flight.append((batch, payload, future))
+            if len(in_flight) >= max(1, max_in_flight):
+                done_batch, done_payload, done_future = in_flight.popleft()
+                yield done_batch, done_payload, done_future.result() if done_future else []
+        while in_flight:
+            done_batch, done_payload, done_future = in_flight.popleft()
+            yield done_batch, done_payload, done_future.result() if done_future else []
+
+
+def embed_in_batches(embeddings, splits, batch_size=64, workers=2, max_in_flight=4):
+    """
+    Вычисляет эмбеддинги частей документов пачками фиксированного размера в пуле потоков.
+
+    Одновременно в работе находится не более max_in_flight пачек, поэтому объём
+    памяти ограничен независимо от размера документа. Пачки возвращаются в исходном порядке.
+
+    Args:
+        embeddings: Модель эмбеддингов.
+        splits (iterable): Части документов.
+        batch_size (int): Размер пачки.
+        workers (int): Количество потоков для вычисления эмбеддингов.
+        max_in_flight (int): Максимальное количество пачек в работе.
+
+    Yields:
+        tuple: (пачка частей документов, список эмбеддингов).
+    """
+    def batches():
+        batch = []
+        for split in splits:
+            batch.append(split)
+            if len(batch) >= batch_size:
+                yield batch, None
+                batch = []
+        if batch:
+            yield batch, None
+
+    for batch, _, vectors in embed_batches(embeddings, batches(), workers, max_in_flight):
+        yield batch, vectors
+
+
+def upsert_batch(vectorstore, batch, vectors, lexical_index=None):
+    """
+    Записывает пачку частей документов с готовыми эмбеддингами в коллекцию Chroma
+    (в раздел тега каждой части, если хранилище разделено по тегам) и, если он
+    передан, в полнотекстовый индекс.
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+        batch (list): Части документов.
+        vectors (list): Эмбеддинги частей документов.
+        lexical_index (LexicalIndex, optional): Полнотекстовый индекс.
+
+    Returns:
+        list: Идентификаторы записанных частей.
+    """
+    ids = [str(uuid.uuid4()) for _ in batch]
+    metadatas = [_sanitize_metadata(split.metadata) for split in batch]
+    documents = [split.page_content for split in batch]
+
+    # В хранилище, разделённом по тегам, каждая часть пишется в раздел своего тега
+    if hasattr(vectorstore, "partition"):
+        groups = {}
+        for position, metadata in enumerate(metadatas):
+            groups.setdefault(metadata.get("tag", ""), []).append(position)
+        targets = [(vectorstore.partition(tag)._collection, positions) for tag, positions in groups.items()]
+    else:
+        targets = [(vectorstore._collection, range(len(batch)))]
+
+    for collection, positions in targets:
+        collection.upsert(
+            ids=[ids[i] for i in positions],
+            embeddings=[vectors[i] for i in positions],
+            metadatas=[metadatas[i] for i in positions],
+            documents=[documents[i] for i in positions]
+        )
+    if lexical_index is not None:
+        lexical_index.add(ids, documents, metadatas)
+    return ids
+
+
+@lru_cache(maxsize=8)
+def get_text_splitter(chunk_size, chunk_overlap):
+    """
+    Возвращает разделитель текста на основе tiktoken, создавая его один раз
+    для каждой пары параметров.
+
+    Args:
+        chunk_size (int): Размер части в токенах.
+        chunk_overlap (int): Перекрытие соседних частей в токенах.
+
+    Returns:
+        RecursiveCharacterTextSplitter: Разделитель текста.
+    """
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+
+def _split_group(documents, chunk_size, chunk_overlap):
+    # Выполняется в процессе пула: разделитель кэшируется в каждом процессе
+    text_splitter = get_text_splitter(chunk_size, chunk_overlap)
+    return [text_splitter.split_documents([document]) for document in documents]
+
+
+def _get_split_pool(workers):
+    global _split_pool, _split_pool_workers
+    with _split_pool_lock:
+        if _split_pool is None or _split_pool_workers != workers:
+            if _split_pool is not None:
+                _split_pool.shutdown()
+            # Пул создаётся из потока конвейера при работающих потоках API, Chroma и
+            # векторизации: fork такого процесса может унаследовать занятые блокировки,
+            # поэтому процессы запускаются через spawn
+            _split_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _split_pool_workers = workers
+        return _split_pool
+
+
+def _shutdown_split_pool():
+    global _split_pool
+    with _split_pool_lock:
+        if _split_pool is not None:
+            _split_pool.shutdown()
+            _split_pool = None
+
+
+atexit.register(_shutdown_split_pool)
+
+
+def split_document_groups(documents, ingest_config=None):
+    """
+    Разбивает документы на части, сохраняя соответствие документ -> его части.
+
+    Если включено параллельное разбиение (ingest.split_workers > 1) и документов не
+    меньше ingest.parallel_split_min_documents, документы разбиваются в пуле процессов.
+    Порядок документов и частей, а также метаданные сохраняются.
+
+    Args:
+        documents: Список документов.
+        ingest_config (IngestConfig, optional): Параметры разбиения.
+
+    Returns:
+        list: Для каждого документа — список его частей.
+    """
+    ingest_config = ingest_config or IngestConfig()
+    documents = list(documents)
+    chunk_size = ingest_config.chunk_size
+    chunk_overlap = ingest_config.chunk_overlap
+    workers = ingest_config.split_workers
+
+    if workers <= 1 or len(documents) < max(2, ingest_config.parallel_split_min_documents):
+        return _split_group(documents, chunk_size, chunk_overlap)
+
+    # Документы делятся на группы по числу процессов; map сохраняет порядок групп
+    group_size = -(-len(documents) // workers)
+    groups = [documents[start:start + group_size] for start in range(0, len(documents), group_size)]
+    pool = _get_split_pool(workers)
+    results = pool.map(
+        _split_group, groups, [chunk_size] * len(groups), [chunk_overlap] * len(groups)
     )
-    new_doc_splits = text_splitter.split_documents(documents)
+    return [splits for group in results for splits in group]
+
+
+def split_documents(documents, ingest_config=None):
+    """
+    Разбивает документы на части для векторизации.
+
+    Args:
+        documents: Список документов.
+        ingest_config (IngestConfig, optional): Параметры разбиения.
+
+    Returns:
+        list: Части документов с метаданными исходных документов.
+    """
+    return [
+        split
+        for splits in split_document_groups(documents, ingest_config)
+        for split in splits
+    ]
+
 
-    # Добавление документов в базу
-    vectorstore.add_documents(new_doc_splits)
+def add_splits_to_db(vectorstore, splits, log_func=None, ingest_config=None, lexical_index=None):
+    """
+    Векторизует готовые части документов пачками в пуле потоков и записывает их
+    в базу пачками того же размера по мере готовности.
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+        splits: Список частей документов.
+        log_func (callable, optional): Функция для логирования сообщений.
+        ingest_config (IngestConfig, optional): Параметры пакетной векторизации.
+        lexical_index (LexicalIndex, optional): Полнотекстовый индекс.
+    """
+    ingest_config = ingest_config or IngestConfig()
 
-    # Удаляем вызов persist
-    # В новой версии, если используется langchain_community, вызов persist не требуется
+    for batch, vectors in embed_in_batches(
+        vectorstore.embeddings,
+        splits,
+        batch_size=ingest_config.batch_size,
+        workers=ingest_config.embed_workers,
+        max_in_flight=ingest_config.max_in_flight
+    ):
+        upsert_batch(vectorstore, batch, vectors, lexical_index)
 
     if log_func:
         log_func(
-            f"Добавлено {len(new_doc_splits)} новых частей документов в векторную базу данных."
+            f"Добавлено {len(splits)} новых частей документов в векторную базу данных."
         )
+        cache = getattr(vectorstore.embeddings, "cache", None)
+        if cache is not None:
+            log_func(f"Кэш эмбеддингов: {cache.stats()}")
+
+
+def add_documents_to_db(vectorstore, documents, log_func=None, ingest_config=None, lexical_index=None):
+    """
+    Добавляет новые документы в существующую векторную базу данных с использованием Chroma.
+
+    Части документов векторизуются пачками в пуле потоков и записываются в базу
+    пачками того же размера по мере готовности.
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+        documents: Список документов для добавления.
+        log_func (callable, optional): Функция для логирования сообщений.
+        ingest_config (IngestConfig, optional): Параметры пакетной векторизации.
+        lexical_index (LexicalIndex, optional): Полнотекстовый индекс.
+    """
+    if log_func:
+        log_func("Добавление новых документов в векторную базу данных...")
 
+    # Разделение документов на части для векторизации
+    new_doc_splits = split_documents(documents, ingest_config)
+
+    # Векторизация и запись в базу пачками
+    add_splits_to_db(
+        vectorstore, new_doc_splits, log_func=log_func, ingest_config=ingest_config, lexical_index=lexical_index
+    )
 
-def remove_existing_documents(vectorstore, source, log_func=None):
+
+def remove_existing_documents(vectorstore, source, log_func=None, lexical_index=None):
     """
     Удаляет существующие записи из базы данных, если их источник совпадает с указанным.
 
+    Поиск выполняется фильтром по метаданным на стороне Chroma, поэтому стоимость
+    пропорциональна числу частей этого источника, а не размеру всей базы. В хранилище,
+    разделённом по тегам, проверяются все разделы (тег источника мог измениться).
+
     Args:
         vectorstore: Экземпляр векторного хранилища.
         source: Источник документа (например, имя файла или URL).
         log_func (callable, optional): Функция для логирования сообщений.
+        lexical_index (LexicalIndex, optional): Полнотекстовый индекс.
     """
     try:
-        # Получение всех документов из базы данных
-        all_docs = vectorstore._collection.get()
+        for collection in get_collections(vectorstore):
+            # Только идентификаторы записей с совпадающим источником
+            matching_ids = collection.get(where={"source": source}, include=[])['ids']
+
+            if matching_ids:
+                # Удаление записей с совпадающим источником
+                collection.delete(ids=matching_ids)
+                if log_func:
+                    log_func(f"Удалены существующие записи для источника: {source}")
+        if lexical_index is not None:
+            lexical_index.remove_sources([source])
+    except Exception as e:
+        if log_func:
+            log_func(f"Ошибка при удалении существующих записей: {e}")
+        raise e
 
-        # Поиск совпадающих записей по источнику
-        matching_ids = [
-            doc_id for doc_id, metadata in zip(all_docs['ids'], all_docs['metadatas'])
-            if metadata.get('source') == source
-        ]
 
-        if matching_ids:
-            # Удаление записей с совпадающим источником
-            vectorstore._collection.delete(ids=matching_ids)
-            if log_func:
-                log_func(f"Удалены существующие записи для источника: {source}")
+def remove_documents_by_sources(vectorstore, sources, log_func=None, batch_size=500, lexical_index=None):
+    """
+    Удаляет записи сразу для многих источников одним фильтром на пачку источников
+    (в каждом разделе, если хранилище разделено по тегам).
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+        sources (iterable): Источники документов (имена файлов или URL).
+        log_func (callable, optional): Функция для логирования сообщений.
+        batch_size (int): Количество источников в одном запросе к Chroma.
+        lexical_index (LexicalIndex, optional): Полнотекстовый индекс.
+
+    Returns:
+        int: Количество удалённых записей.
+    """
+    sources = list(dict.fromkeys(sources))
+    removed = 0
+    try:
+        collections = get_collections(vectorstore)
+        for start in range(0, len(sources), batch_size):
+            batch = sources[start:start + batch_size]
+            for collection in collections:
+                matching_ids = collection.get(
+                    where={"source": {"$in": batch}}, include=[]
+                )['ids']
+                if matching_ids:
+                    collection.delete(ids=matching_ids)
+                    removed += len(matching_ids)
+            if lexical_index is not None:
+                lexical_index.remove_sources(batch)
+        if log_func:
+            log_func(f"Удалено {removed} записей для {len(sources)} источников.")
+        return removed
     except Exception as e:
         if log_func:
             log_func(f"Ошибка при удалении существующих записей: {e}")
-        raise e
\ No newline at end of file
+        raise e
@@ -1,9 +1,27 @@
-from langchain_chroma import Chroma
-from langchain_nomic.embeddings import NomicEmbeddings
-from langchain_community.document_loaders import WebBaseLoader, PyMuPDFLoader, TextLoader
+from langchain_community.document_loaders import PyMuPDFLoader, TextLoader
 from langchain.schema import Document
+from bs4 import BeautifulSoup
+import hashlib
 import os
-from app.db_utils import add_documents_to_db, remove_existing_documents
+import re
+import requests
+from dataclasses import dataclass, field
+from app.cache_utils import text_hash
+from app.db_utils import (
+    add_documents_to_db, remove_existing_documents, count_documents
+)
+from app.store_utils import get_vectorstore, get_manifest, get_lexical_index, invalidate_answers
+
+
+@dataclass
+class LoadedSource:
+    """
+    Загруженный источник, готовый к записи в векторное хранилище.
+    """
+    source: str
+    documents: object  # список документов или итератор при lazy=True
+    params: dict
+    fingerprint: dict = field(default_factory=dict)
 
 
 def is_valid_file_or_url(path):
@@ -23,6 +41,107 @@ def is_valid_file_or_url(path):
     return False
 
 
+def file_hash(path):
+    """
+    Вычисляет SHA-256 хэш содержимого файла.
+
+    Args:
+        path (str): Путь к файлу.
+
+    Returns:
+        str: Хэш в шестнадцатеричном виде.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def ingest_params(tag, config):
+    """
+    Возвращает параметры загрузки, при изменении которых источник нужно перезагрузить.
+
+    Args:
+        tag (str): Тег.
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        dict: Тег, параметры разбиения и модель эмбеддингов.
+    """
+    return {
+        "tag": tag,
+        "chunk_size": config.ingest.chunk_size,
+        "chunk_overlap": config.ingest.chunk_overlap,
+        "embedding_model": config.vector_db.embedding_model,
+    }
+
+
+def _same_params(entry, params):
+    return entry is not None and all(entry.get(name) == value for name, value in params.items())
+
+
+def fetch_url(url, config, entry=None):
+    """
+    Загружает страницу; при наличии записи манифеста выполняет условный GET.
+
+    Args:
+        url (str): URL страницы.
+        config (Config): Конфигурационный объект.
+        entry (dict, optional): Запись манифеста с ETag/Last-Modified прошлой загрузки.
+
+    Returns:
+        requests.Response: Ответ сервера (304, если страница не изменилась).
+    """
+    headers = {"User-Agent": config.user_agent}
+    if entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    return requests.get(url, headers=headers, timeout=30)
+
+
+def documents_from_html(html, url):
+    """
+    Извлекает текст и метаданные страницы так же, как WebBaseLoader.
+
+    Args:
+        html (str): HTML страницы.
+        url (str): URL страницы.
+
+    Returns:
+        list: Список из одного документа.
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    metadata = {"source": url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if html_tag := soup.find("html"):
+        metadata["language"] = html_tag.get("lang", "No language found.")
+    return [Document(page_content=soup.get_text(), metadata=metadata)]
+
+
+def clean_document(document):
+    """
+    Очищает текст документа: убирает пробелы в концах строк и лишние пустые строки.
+
+    Args:
+        document: Документ.
+
+    Returns:
+        Document: Тот же документ или None, если текста в нём не осталось.
+    """
+    text = "\n".join(line.rstrip() for line in document.page_content.splitlines())
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    if not text:
+        return None
+    document.page_content = text
+    return document
+
+
 def initialize_database(vectorstore, persist_directory, log_func=None):
     """
     Инициализирует базу данных с тестовой записью, если она не существует.
@@ -39,9 +158,8 @@ def initialize_database(vectorstore, persist_directory, log_func=None):
             if log_func:
                 log_func(f"Директория для базы данных создана: {persist_directory}")
 
-        # Проверяем, есть ли записи в базе
-        all_docs = vectorstore._collection.get()
-        if not all_docs['ids']:
+        # Проверяем, есть ли записи в базе (без выборки самих записей)
+        if count_documents(vectorstore) == 0:
             if log_func:
                 log_func("База данных пуста. Добавление тестовой записи.")
             test_document = Document(
@@ -57,9 +175,21 @@ def initialize_database(vectorstore, persist_directory, log_func=None):
         raise
 
 
-def add_document_to_store(source, tag, config, log_func=None, document_content=None):
+def _tag_documents(documents, tag, stored_source):
+    for doc in documents:
+        doc.metadata["tag"] = tag
+        doc.metadata["source"] = stored_source
+        yield doc
+
+
+def load_source(source, tag, config, log_func=None, document_content=None, force=False, lazy=False):
     """
-    Добавляет документ (из файла или URL) в векторное хранилище.
+    Загружает документ из файла или URL, если он изменился с прошлой загрузки.
+
+    Источник считается неизменным, если по манифесту загрузки совпадают параметры
+    загрузки и отпечаток содержимого (тот же размер, mtime или хэш файла, ответ 304
+    или тот же хэш страницы). Функция не пишет в векторное хранилище и может
+    вызываться из нескольких потоков одновременно.
 
     Args:
         source (str): Путь до файла или URL источника.
@@ -67,74 +197,185 @@ def add_document_to_store(source, tag, config, log_func=None, document_content=N
         config (Config): Конфигурационный объект.
         log_func (callable, optional): Функция для логирования.
         document_content (str, optional): Содержимое документа (для URL).
+        force (bool): Загрузить источник независимо от манифеста.
+        lazy (bool): Вернуть документы файла как итератор (постраничная загрузка PDF)
+            вместо списка.
+
+    Returns:
+        LoadedSource: Загруженный источник или None, если он не изменился.
     """
-    try:
-        # Логируем полученный путь
-        if log_func:
-            log_func(f"Исходный путь: {source}")
+    # Проверка пути
+    if not is_valid_file_or_url(source):
+        raise ValueError(f"File path {source} is not a valid file or url")
 
-        # Проверка пути
-        if not is_valid_file_or_url(source):
-            raise ValueError(f"File path {source} is not a valid file or url")
+    # Определяем, является ли источник файлом или URL
+    is_url = source.startswith("http://") or source.startswith("https://")
+    stored_source = source if is_url else os.path.basename(source)  # Название файла или полная ссылка
 
-        # Инициализация векторного хранилища
-        embeddings = NomicEmbeddings(
-            model=config.vector_db.embedding_model,
-            inference_mode=config.vector_db.inference_mode
-        )
-        vectorstore = Chroma(
-            persist_directory=config.vector_db.persist_directory,
-            embedding_function=embeddings
-        )
-        initialize_database(vectorstore, config.vector_db.persist_directory, log_func)
+    # Сверка с манифестом прошлой загрузки
+    manifest = get_manifest(config)
+    params = ingest_params(tag, config)
+    entry = None if force else manifest.get(stored_source)
+    unchanged_params = _same_params(entry, params)
+    fingerprint = {}
 
-        # Определяем, является ли источник файлом или URL
-        is_url = source.startswith("http://") or source.startswith("https://")
-        stored_source = source if is_url else os.path.basename(source)  # Название файла или полная ссылка
+    # Загрузка содержимого документа
+    if document_content is not None:
+        fingerprint["content_hash"] = text_hash(document_content)
+        if unchanged_params and entry["content_hash"] == fingerprint["content_hash"]:
+            if log_func:
+                log_func(f"Источник не изменился, пропуск: {stored_source}")
+            return None
+        documents = [Document(page_content=document_content, metadata={"source": stored_source, "tag": tag})]
+    elif is_url:
+        try:
+            response = fetch_url(source, config, entry if unchanged_params else None)
+        except Exception as e:
+            if log_func:
+                log_func(f"Ошибка загрузки файла: {source}. Причина: {e}")
+            raise ValueError(f"Error loading {source}: {e}")
+        if response.status_code == 304:
+            if log_func:
+                log_func(f"Страница не изменилась (304), пропуск: {stored_source}")
+            return None
+        if not response.ok:
+            raise ValueError(f"Error loading {source}: HTTP {response.status_code}")
 
-        # Удаляем старые записи с таким же source, если они есть
+        fingerprint = {
+            "content_hash": hashlib.sha256(response.content).hexdigest(),
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+        }
+        if unchanged_params and entry["content_hash"] == fingerprint["content_hash"]:
+            manifest.touch(stored_source, etag=fingerprint["etag"], last_modified=fingerprint["last_modified"])
+            if log_func:
+                log_func(f"Содержимое страницы не изменилось, пропуск: {stored_source}")
+            return None
+        # Как в WebBaseLoader: без charset requests декодирует text/html как ISO-8859-1
+        response.encoding = response.apparent_encoding
+        documents = documents_from_html(response.text, source)
+    else:
+        if source.endswith(".pdf"):
+            loader = PyMuPDFLoader(source)
+        elif source.endswith(".txt"):
+            loader = TextLoader(source)
+        else:
+            raise ValueError(f"Неподдерживаемый формат файла: {source}. Допустимы только .txt и .pdf")
+
+        # Проверка файла перед загрузкой
+        absolute_path = os.path.abspath(source)
         if log_func:
-            log_func(f"Удаление старых записей для source: {stored_source}")
-        remove_existing_documents(vectorstore, stored_source)
+            log_func(f"Абсолютный путь к файлу: {absolute_path}")
+        if not os.path.isfile(absolute_path):
+            raise FileNotFoundError(f"Файл {absolute_path} не найден.")
+        if os.path.getsize(absolute_path) == 0:
+            raise ValueError(f"Файл {absolute_path} пуст.")
 
-        # Загрузка содержимого документа
-        if document_content is None:
-            if is_url:
-                loader = WebBaseLoader(source)
-            elif source.endswith(".pdf"):
-                loader = PyMuPDFLoader(source)
-            elif source.endswith(".txt"):
-                loader = TextLoader(source)
-            else:
-                raise ValueError(f"Неподдерживаемый формат файла: {source}. Допустимы только .txt и .pdf")
-
-            # Проверка файла перед загрузкой
-            if not is_url:  # Для URL проверка не требуется
-                absolute_path = os.path.abspath(source)
-                if log_func:
-                    log_func(f"Абсолютный путь к файлу: {absolute_path}")
-                if not os.path.isfile(absolute_path):
-                    raise FileNotFoundError(f"Файл {absolute_path} не найден.")
-                if os.path.getsize(absolute_path) == 0:
-                    raise ValueError(f"Файл {absolute_path} пуст.")
+        stat = os.stat(absolute_path)
+        fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime}
+        if unchanged_params and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            if log_func:
+                log_func(f"Файл не изменился, пропуск: {stored_source}")
+            return None
+        fingerprint["content_hash"] = file_hash(absolute_path)
+        if unchanged_params and entry["content_hash"] == fingerprint["content_hash"]:
+            manifest.touch(stored_source, size=stat.st_size, mtime=stat.st_mtime)
+            if log_func:
+                log_func(f"Содержимое файла не изменилось, пропуск: {stored_source}")
+            return None
 
+        if lazy:
+            documents = loader.lazy_load()
+        else:
             try:
                 documents = loader.load()
-                # Добавляем тег в метаданные
-                for doc in documents:
-                    doc.metadata["tag"] = tag
-                    doc.metadata["source"] = stored_source
             except Exception as e:
                 if log_func:
                     log_func(f"Ошибка загрузки файла: {source}. Причина: {e}")
                 raise ValueError(f"Error loading {source}: {e}")
-        else:
-            documents = [Document(page_content=document_content, metadata={"source": stored_source, "tag": tag})]
 
-        # Добавление документов в векторное хранилище
+    # Добавляем тег в метаданные
+    documents = _tag_documents(documents, tag, stored_source)
+    if not lazy:
+        documents = list(documents)
+
+    return LoadedSource(source=stored_source, documents=documents, params=params, fingerprint=fingerprint)
+
+
+def store_source(vectorstore, loaded, config, log_func=None):
+    """
+    Заменяет записи источника в векторном хранилище и обновляет манифест загрузки.
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+        loaded (LoadedSource): Загруженный источник.
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+    """
+    # Удаляем старые записи с таким же source, если они есть
+    if log_func:
+        log_func(f"Удаление старых записей для source: {loaded.source}")
+    lexical_index = get_lexical_index(config, log_func)
+    remove_existing_documents(vectorstore, loaded.source, lexical_index=lexical_index)
+
+    # Добавление документов в векторное хранилище
+    if log_func:
+        log_func(f"Добавление документа в хранилище: {loaded.source} с тегом: {loaded.params['tag']}")
+    add_documents_to_db(
+        vectorstore, loaded.documents, log_func=log_func, ingest_config=config.ingest, lexical_index=lexical_index
+    )
+    get_manifest(config).record(loaded.source, **loaded.params, **loaded.fingerprint)
+    invalidate_answers(loaded.params["tag"])
+
+
+def add_document_to_store(source, tag, config, log_func=None, document_content=None, force=False):
+    """
+    Добавляет документ (из файла или URL) в векторное хранилище.
+
+    Файлы и страницы загружаются через потоковый конвейер add_sources_to_store
+    (постраничная загрузка PDF, очистка, пакетная векторизация), так же как при
+    пакетной загрузке. Если по манифесту загрузки источник не изменился с прошлого
+    раза, документ не перезагружается (см. load_source).
+
+    Args:
+        source (str): Путь до файла или URL источника.
+        tag (str): Тег.
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+        document_content (str, optional): Содержимое документа (для URL).
+        force (bool): Перезагрузить источник независимо от манифеста.
+
+    Returns:
+        bool: True, если документ был загружен, False, если он не изменился.
+    """
+    try:
+        # Логируем полученный путь
         if log_func:
-            log_func(f"Добавление документа в хранилище: {stored_source} с тегом: {tag}")
-        add_documents_to_db(vectorstore, documents, log_func=log_func)
+            log_func(f"Исходный путь: {source}")
+
+        # Проверка пути
+        if not is_valid_file_or_url(source):
+            raise ValueError(f"File path {source} is not a valid file or url")
+
+        if document_content is None:
+            # Импорт здесь: pipeline_utils сам импортирует этот модуль
+            from app.pipeline_utils import add_sources_to_store
+
+            result = add_sources_to_store([(source, tag)], config, log_func=log_func, force=force, concurrency=1)
+            return result["added"] > 0
+
+        # Общее для процесса векторное хранилище
+        vectorstore = get_vectorstore(config, log_func)
+        initialize_database(vectorstore, config.vector_db.persist_directory, log_func)
+
+        loaded = load_source(source, tag, config, log_func=log_func, document_content=document_content, force=force)
+        if loaded is None:
+            return False
+
+        # Та же очистка, что и в конвейере, чтобы части и кэш эмбеддингов совпадали
+        loaded.documents = [doc for doc in map(clean_document, loaded.documents) if doc is not None]
+        store_source(vectorstore, loaded, config, log_func=log_func)
+        return True
 
     except Exception as e:
         if log_func:
@@ -0,0 +1,97 @@
+# app/executor_utils.py
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.config import ExecutorsConfig
+
+# Отдельные пулы потоков для разных видов блокирующей работы API, чтобы долгая
+# генерация ответа или загрузка документа не занимала потоки поиска
+_lock = threading.Lock()
+_executors = {}
+_semaphores = {}
+_settings = ExecutorsConfig()
+
+
+def configure_executors(config):
+    """
+    Задаёт размеры пулов потоков из конфигурации. Вызывается до первого обращения к пулам.
+
+    Args:
+        config (Config): Конфигурационный объект.
+    """
+    global _settings
+    with _lock:
+        _settings = config.executors
+
+
+def _pool_size(name):
+    return max(1, getattr(_settings, f"{name}_workers"))
+
+
+def get_executor(name):
+    """
+    Возвращает общий пул потоков с указанным именем, создавая его при первом обращении.
+
+    Args:
+        name (str): Имя пула: "search", "llm" или "ingest".
+
+    Returns:
+        ThreadPoolExecutor: Пул потоков.
+    """
+    with _lock:
+        executor = _executors.get(name)
+        if executor is None:
+            executor = ThreadPoolExecutor(
+                max_workers=_pool_size(name),
+                thread_name_prefix=f"{name}-worker"
+            )
+            _executors[name] = executor
+        return executor
+
+
+def _get_semaphore(name):
+    with _lock:
+        semaphore = _semaphores.get(name)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(_pool_size(name) + _settings.max_queue)
+            _semaphores[name] = semaphore
+        return semaphore
+
+
+async def run_in_executor(name, func, *args, **kwargs):
+    """
+    Выполняет блокирующую функцию в пуле потоков, не блокируя цикл событий.
+
+    Количество задач в работе и в очереди пула ограничено (размер пула плюс
+    executors.max_queue); остальные запросы ожидают, не занимая потоков.
+
+    Args:
+        name (str): Имя пула: "search", "llm" или "ingest".
+        func (callable): Блокирующая функция.
+        *args: Позиционные аргументы функции.
+        **kwargs: Именованные аргументы функции.
+
+    Returns:
+        Результат функции.
+    """
+    loop = asyncio.get_running_loop()
+    async with _get_semaphore(name):
+        return await loop.run_in_executor(
+            get_executor(name), functools.partial(func, *args, **kwargs)
+        )
+
+
+def shutdown_executors(wait=True):
+    """
+    Останавливает все пулы потоков.
+
+    Args:
+        wait (bool): Дождаться завершения выполняющихся задач.
+    """
+    with _lock:
+        for executor in _executors.values():
+            executor.shutdown(wait=wait)
+        _executors.clear()
+        _semaphores.clear()
@@ -0,0 +1,143 @@
+# app/manifest_utils.py
+
+import os
+import sqlite3
+import threading
+import time
+
+
+class IngestManifest:
+    """
+    Постоянный манифест загрузки: для каждого источника в хранилище хранит отпечаток
+    содержимого (размер, mtime, хэш, ETag/Last-Modified) и параметры векторизации.
+    """
+
+    FIELDS = (
+        "source", "tag", "size", "mtime", "content_hash", "etag", "last_modified",
+        "chunk_size", "chunk_overlap", "embedding_model", "updated_at",
+    )
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sources (
+                source TEXT PRIMARY KEY,
+                tag TEXT,
+                size INTEGER,
+                mtime REAL,
+                content_hash TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                chunk_size INTEGER,
+                chunk_overlap INTEGER,
+                embedding_model TEXT,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS sources_tag_updated_at ON sources (tag, updated_at)"
+        )
+        self._conn.commit()
+
+    def get(self, source):
+        """
+        Возвращает запись манифеста для источника.
+
+        Args:
+            source (str): Источник (имя файла или URL).
+
+        Returns:
+            dict: Запись манифеста или None, если источник не загружался.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM sources WHERE source = ?", (source,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def tag_updated_at(self, tag=None):
+        """
+        Возвращает время последней загрузки источников с тегом.
+
+        Args:
+            tag (str, optional): Тег; без тега или для "all" — по всем источникам.
+
+        Returns:
+            float: Время последней загрузки или None, если источников нет.
+        """
+        with self._lock:
+            if tag is None or tag.lower() == "all":
+                row = self._conn.execute("SELECT MAX(updated_at) FROM sources").fetchone()
+            else:
+                row = self._conn.execute(
+                    "SELECT MAX(updated_at) FROM sources WHERE tag = ?", (tag,)
+                ).fetchone()
+        return row[0]
+
+    def record(self, source, **fields):
+        """
+        Сохраняет отпечаток источника после успешной загрузки.
+
+        Args:
+            source (str): Источник (имя файла или URL).
+            **fields: Поля записи манифеста (tag, size, mtime, content_hash и т.д.).
+        """
+        values = {name: fields.get(name) for name in self.FIELDS}
+        values["source"] = source
+        values["updated_at"] = time.time()
+        placeholders = ",".join("?" * len(self.FIELDS))
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO sources ({','.join(self.FIELDS)}) VALUES ({placeholders})",
+                tuple(values[name] for name in self.FIELDS)
+            )
+            self._conn.commit()
+
+    def touch(self, source, **fields):
+        """
+        Обновляет отдельные поля записи без изменения остальных (например, mtime или ETag).
+
+        Args:
+            source (str): Источник (имя файла или URL).
+            **fields: Обновляемые поля.
+        """
+        fields = {name: value for name, value in fields.items() if name in self.FIELDS}
+        if not fields:
+            return
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE sources SET {assignments} WHERE source = ?",
+                (*fields.values(), source)
+            )
+            self._conn.commit()
+
+    def remove(self, sources):
+        """
+        Удаляет записи манифеста для источников.
+
+        Args:
+            sources (iterable): Источники (имена файлов или URL).
+        """
+        with self._lock:
+            self._conn.executemany(
+                "DELETE FROM sources WHERE source = ?", [(source,) for source in sources]
+            )
+            self._conn.commit()
+
+    def close(self):
+        """
+        Закрывает соединение с файлом манифеста.
+        """
+        with self._lock:
+            self._conn.close()
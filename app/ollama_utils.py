@@ -0,0 +1,240 @@
+# app/ollama_utils.py
+
+import subprocess
+import threading
+import time
+
+import requests
+from langchain_ollama import ChatOllama
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+# Общие клиенты моделей по ключу (модель, параметры)
+_chat_models = {}
+_chat_models_lock = threading.Lock()
+
+DEFAULT_BASE_URL = "http://127.0.0.1:11434"
+
+
+class OllamaMonitor:
+    """
+    Фоновый монитор сервера Ollama.
+
+    Проверяет сервер с заданным интервалом и хранит последнее состояние, поэтому
+    обработка запроса не тратит время на проверку. Если сервер недоступен, запускает
+    `ollama serve`; одновременно существует не более одного запущенного монитором процесса.
+    """
+
+    def __init__(self, base_url, interval=10.0, startup_timeout=15.0, log_func=None):
+        self.base_url = base_url.rstrip("/")
+        self.interval = interval
+        self.startup_timeout = startup_timeout
+        self.log_func = log_func
+        self.healthy = False
+        self.last_check = None
+        self.last_error = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def probe(self):
+        """
+        Проверяет доступность сервера и обновляет сохранённое состояние.
+
+        Returns:
+            bool: True, если сервер отвечает.
+        """
+        try:
+            response = requests.get(f"{self.base_url}/api/version", timeout=2)
+            self.healthy = response.status_code < 500
+            self.last_error = None if self.healthy else f"HTTP {response.status_code}"
+        except requests.RequestException as e:
+            self.healthy = False
+            self.last_error = str(e)
+        self.last_check = time.time()
+        return self.healthy
+
+    def _start_server(self):
+        # Вызывается под self._lock: не запускаем второй процесс, пока жив первый
+        if self._process is not None and self._process.poll() is None:
+            return
+        if self.log_func:
+            self.log_func("Сервер Ollama не запущен. Попытка запуска...")
+        try:
+            self._process = subprocess.Popen(
+                ["ollama", "serve"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except Exception as e:
+            if self.log_func:
+                self.log_func(f"Не удалось запустить сервер Ollama: {e}")
+            raise RuntimeError("Не удалось запустить сервер Ollama") from e
+        if self.log_func:
+            self.log_func(f"Сервер Ollama запущен (pid {self._process.pid}).")
+
+    def ensure_running(self):
+        """
+        Гарантирует, что сервер Ollama запущен. Если по последней проверке сервер
+        доступен, возвращается сразу без сетевого запроса.
+
+        Returns:
+            bool: True, если сервер доступен.
+
+        Raises:
+            RuntimeError: Если сервер не удалось запустить.
+        """
+        if self.healthy:
+            return True
+
+        with self._lock:
+            if self.healthy or self.probe():
+                return True
+            self._start_server()
+            deadline = time.time() + self.startup_timeout
+            while time.time() < deadline:
+                if self.probe():
+                    return True
+                time.sleep(0.5)
+        raise RuntimeError("Не удалось запустить сервер Ollama")
+
+    def _run(self):
+        while not self._stop.is_set():
+            was_healthy = self.healthy
+            if not self.probe():
+                if was_healthy and self.log_func:
+                    self.log_func(f"Сервер Ollama недоступен: {self.last_error}")
+                try:
+                    with self._lock:
+                        self._start_server()
+                except RuntimeError:
+                    pass
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """
+        Запускает фоновую проверку сервера.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ollama-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Останавливает фоновую проверку и запущенный монитором процесс `ollama serve`.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
+        with self._lock:
+            if self._process is not None and self._process.poll() is None:
+                self._process.terminate()
+            self._process = None
+
+    def status(self):
+        """
+        Возвращает последнее известное состояние сервера.
+
+        Returns:
+            dict: Состояние сервера.
+        """
+        supervised = self._process is not None and self._process.poll() is None
+        return {
+            "healthy": self.healthy,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+            "supervised_pid": self._process.pid if supervised else None,
+        }
+
+
+def get_ollama_monitor(config=None, log_func=None):
+    """
+    Возвращает общий для процесса монитор сервера Ollama.
+
+    Args:
+        config (Config, optional): Конфигурационный объект (адрес и интервалы проверки).
+        log_func (callable, optional): Функция для логирования.
+
+    Returns:
+        OllamaMonitor: Монитор сервера.
+    """
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            if config is not None:
+                _monitor = OllamaMonitor(
+                    config.ollama.base_url,
+                    interval=config.ollama.health_interval,
+                    startup_timeout=config.ollama.startup_timeout,
+                    log_func=log_func
+                )
+            else:
+                _monitor = OllamaMonitor(DEFAULT_BASE_URL, log_func=log_func)
+        return _monitor
+
+
+def get_chat_model(config=None, model=None, temperature=0.7, **options):
+    """
+    Возвращает общий клиент модели для сочетания (модель, параметры), создавая его
+    при первом обращении. Клиент передаёт серверу keep_alive из конфигурации, чтобы
+    модель не выгружалась между запросами.
+
+    Args:
+        config (Config, optional): Конфигурационный объект.
+        model (str, optional): Название модели (по умолчанию ollama.default_model).
+        temperature (float): Температура для генерации ответа.
+        **options: Дополнительные параметры ChatOllama (например, num_ctx).
+
+    Returns:
+        ChatOllama: Клиент модели.
+    """
+    model = model or config.ollama.default_model
+    base_url = config.ollama.base_url if config else DEFAULT_BASE_URL
+    keep_alive = config.ollama.keep_alive if config else None
+    key = (model, temperature, base_url, keep_alive, tuple(sorted(options.items())))
+    with _chat_models_lock:
+        llm = _chat_models.get(key)
+        if llm is None:
+            llm = ChatOllama(
+                model=model,
+                temperature=temperature,
+                base_url=base_url,
+                keep_alive=keep_alive,
+                **options
+            )
+            _chat_models[key] = llm
+        return llm
+
+
+def warm_up_model(config, model=None, log_func=None):
+    """
+    Загружает модель в память сервера Ollama заранее, чтобы первый запрос не ждал загрузки.
+
+    Args:
+        config (Config): Конфигурационный объект.
+        model (str, optional): Название модели (по умолчанию ollama.default_model).
+        log_func (callable, optional): Функция для логирования.
+
+    Returns:
+        bool: True, если модель загружена.
+    """
+    model = model or config.ollama.default_model
+    try:
+        get_ollama_monitor(config, log_func).ensure_running()
+        # Запрос генерации без prompt только загружает модель
+        response = requests.post(
+            f"{config.ollama.base_url.rstrip('/')}/api/generate",
+            json={"model": model, "keep_alive": config.ollama.keep_alive},
+            timeout=config.ollama.warm_up_timeout
+        )
+        response.raise_for_status()
+        if log_func:
+            log_func(f"Модель {model} загружена (keep_alive: {config.ollama.keep_alive}).")
+        return True
+    except Exception as e:
+        if log_func:
+            log_func(f"Не удалось прогреть модель {model}: {e}")
+        return False
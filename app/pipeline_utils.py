@@ -0,0 +1,350 @@
+# app/pipeline_utils.py
+
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+
+from app.db_utils import split_document_groups, embed_batches, upsert_batch, remove_documents_by_sources
+from app.document_utils import load_source, initialize_database, clean_document
+from app.store_utils import get_vectorstore, get_manifest, get_lexical_index, invalidate_answers
+
+# Маркер конца потока данных между стадиями
+_DONE = object()
+
+
+class PipelineStopped(Exception):
+    """
+    Конвейер остановлен из-за ошибки в одной из стадий.
+    """
+
+
+class StageStats:
+    """
+    Счётчики стадии конвейера: количество обработанных элементов и время работы.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items, seconds):
+        with self._lock:
+            self.items += items
+            self.busy_seconds += seconds
+
+    def as_dict(self, wall_seconds):
+        return {
+            "stage": self.name,
+            "items": self.items,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "items_per_second": round(self.items / self.busy_seconds, 2) if self.busy_seconds else 0.0,
+            "utilization": round(self.busy_seconds / wall_seconds, 3) if wall_seconds else 0.0,
+        }
+
+
+class IngestPipeline:
+    """
+    Потоковый конвейер загрузки: load → clean → split → embed → upsert.
+
+    Стадии работают в отдельных потоках и соединены очередями ограниченного размера
+    (ingest.queue_size), поэтому медленная стадия притормаживает предыдущие, а объём
+    памяти не зависит от размера документа или списка источников. Загрузка выполняется
+    в concurrency потоках с ограничением ingest.per_host_concurrency запросов к одному
+    хосту, векторизация — пачками по ingest.batch_size в пуле ingest.embed_workers.
+    Для каждой стадии считается пропускная способность.
+    """
+
+    def __init__(self, vectorstore, config, log_func=None, force=False, concurrency=None):
+        self.vectorstore = vectorstore
+        self.config = config
+        self.log_func = log_func
+        self.force = force
+        self.concurrency = max(1, concurrency or config.ingest.fetch_concurrency)
+        self.stats = {name: StageStats(name) for name in ("load", "clean", "split", "embed", "upsert")}
+        self.added = 0
+        self.skipped = 0
+        self._counter_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error = None
+        self._host_semaphores = {}
+        self._host_lock = threading.Lock()
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineStopped()
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise PipelineStopped()
+
+    def _fail(self, error):
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    def _run_stage(self, target, *args):
+        try:
+            target(*args)
+        except PipelineStopped:
+            pass
+        except Exception as e:
+            self._fail(e)
+
+    def _host_semaphore(self, source):
+        host = urlparse(source).netloc or "local"
+        with self._host_lock:
+            if host not in self._host_semaphores:
+                self._host_semaphores[host] = threading.Semaphore(
+                    max(1, self.config.ingest.per_host_concurrency)
+                )
+            return self._host_semaphores[host]
+
+    def _load_stage(self, sources_q, out_q):
+        while True:
+            entry = self._get(sources_q)
+            if entry is _DONE:
+                return
+            source, tag = entry
+            if self.log_func:
+                self.log_func(f"Загрузка источника: {source} с тегом: {tag}")
+            started = time.perf_counter()
+            with self._host_semaphore(source):
+                loaded = load_source(source, tag, self.config, log_func=self.log_func, force=self.force, lazy=True)
+            self.stats["load"].add(0, time.perf_counter() - started)
+            if loaded is None:
+                with self._counter_lock:
+                    self.skipped += 1
+                continue
+
+            documents = iter(loaded.documents)
+            while True:
+                started = time.perf_counter()
+                try:
+                    document = next(documents)
+                except StopIteration:
+                    break
+                except Exception as e:
+                    raise ValueError(f"Error loading {source}: {e}")
+                self.stats["load"].add(1, time.perf_counter() - started)
+                self._put(out_q, ("document", loaded, document))
+            self._put(out_q, ("end", loaded, None))
+
+    def _clean_stage(self, in_q, out_q):
+        while True:
+            item = self._get(in_q)
+            if item is _DONE:
+                self._put(out_q, _DONE)
+                return
+            kind, loaded, document = item
+            if kind == "document":
+                started = time.perf_counter()
+                document = clean_document(document)
+                self.stats["clean"].add(1, time.perf_counter() - started)
+                if document is None:
+                    continue
+            self._put(out_q, (kind, loaded, document))
+
+    def _split_stage(self, in_q, out_q):
+        # Уже готовые документы забираются из очереди без ожидания, чтобы разбивать их
+        # группой (в пуле процессов, если он включён)
+        limit = max(1, self.config.ingest.parallel_split_min_documents)
+        while True:
+            items = [self._get(in_q)]
+            while items[-1] is not _DONE and len(items) < limit:
+                try:
+                    items.append(in_q.get_nowait())
+                except queue.Empty:
+                    break
+
+            documents = [item[2] for item in items if item is not _DONE and item[0] == "document"]
+            started = time.perf_counter()
+            groups = split_document_groups(documents, self.config.ingest)
+            self.stats["split"].add(sum(len(group) for group in groups), time.perf_counter() - started)
+            groups = iter(groups)
+
+            for item in items:
+                if item is _DONE:
+                    self._put(out_q, _DONE)
+                    return
+                kind, loaded, _ = item
+                if kind == "end":
+                    self._put(out_q, item)
+                    continue
+                for split in next(groups):
+                    self._put(out_q, ("split", loaded, split))
+
+    def _embed_stage(self, in_q, out_q):
+        batch_size = self.config.ingest.batch_size
+
+        def batches():
+            # Источник, все части которого уже попали в пачку, передаётся вместе с ней,
+            # чтобы стадия записи могла обновить манифест после записи пачки
+            batch, finished = [], []
+            while True:
+                item = self._get(in_q)
+                if item is _DONE:
+                    break
+                kind, loaded, split = item
+                if kind == "end":
+                    finished.append(loaded)
+                    continue
+                batch.append((loaded, split))
+                if len(batch) >= batch_size:
+                    yield batch, finished
+                    batch, finished = [], []
+            if batch or finished:
+                yield batch, finished
+
+        def split_batches():
+            for batch, finished in batches():
+                yield [split for _, split in batch], ([loaded for loaded, _ in batch], finished)
+
+        started = time.perf_counter()
+        for splits, payload, vectors in embed_batches(
+            self.vectorstore.embeddings,
+            split_batches(),
+            workers=self.config.ingest.embed_workers,
+            max_in_flight=self.config.ingest.max_in_flight
+        ):
+            self.stats["embed"].add(len(splits), time.perf_counter() - started)
+            self._put(out_q, (splits, payload, vectors))
+            started = time.perf_counter()
+        self._put(out_q, _DONE)
+
+    def _upsert_stage(self, in_q):
+        manifest = get_manifest(self.config)
+        lexical_index = get_lexical_index(self.config, self.log_func)
+        started_sources = set()
+        while True:
+            item = self._get(in_q)
+            if item is _DONE:
+                return
+            splits, (owners, finished), vectors = item
+            started = time.perf_counter()
+
+            # Старые записи источника удаляются перед первой записью его новых частей
+            new_sources = [loaded.source for loaded in owners + finished if loaded.source not in started_sources]
+            new_sources = list(dict.fromkeys(new_sources))
+            if new_sources:
+                remove_documents_by_sources(
+                    self.vectorstore, new_sources, log_func=self.log_func, lexical_index=lexical_index
+                )
+                started_sources.update(new_sources)
+
+            if splits:
+                upsert_batch(self.vectorstore, splits, vectors, lexical_index)
+            for loaded in finished:
+                manifest.record(loaded.source, **loaded.params, **loaded.fingerprint)
+                invalidate_answers(loaded.params["tag"])
+                self.added += 1
+            self.stats["upsert"].add(len(splits), time.perf_counter() - started)
+
+    def run(self, sources):
+        """
+        Пропускает источники через конвейер.
+
+        Args:
+            sources (iterable): Пары (путь до файла или URL, тег).
+
+        Returns:
+            dict: Количество загруженных и пропущенных источников и статистика стадий.
+        """
+        queue_size = max(1, self.config.ingest.queue_size)
+        sources_q = queue.Queue(maxsize=self.concurrency * 2)
+        load_q = queue.Queue(maxsize=queue_size)
+        clean_q = queue.Queue(maxsize=queue_size)
+        split_q = queue.Queue(maxsize=queue_size)
+        embed_q = queue.Queue(maxsize=max(1, self.config.ingest.max_in_flight))
+
+        def feed():
+            for entry in sources:
+                self._put(sources_q, entry)
+            for _ in range(self.concurrency):
+                self._put(sources_q, _DONE)
+
+        def load_all():
+            loaders = [
+                threading.Thread(target=self._run_stage, args=(self._load_stage, sources_q, load_q), daemon=True)
+                for _ in range(self.concurrency)
+            ]
+            for loader in loaders:
+                loader.start()
+            for loader in loaders:
+                loader.join()
+            self._put(load_q, _DONE)
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=(feed,), daemon=True),
+            threading.Thread(target=self._run_stage, args=(load_all,), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._clean_stage, load_q, clean_q), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._split_stage, clean_q, split_q), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._embed_stage, split_q, embed_q), daemon=True),
+        ]
+        wall_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        self._run_stage(self._upsert_stage, embed_q)
+        if self._error is not None:
+            self._stop.set()
+        for thread in threads:
+            thread.join()
+        wall_seconds = time.perf_counter() - wall_started
+
+        if self._error is not None:
+            if self.log_func:
+                self.log_func(f"Ошибка в конвейере загрузки: {self._error}")
+            raise self._error
+
+        stats = [stage.as_dict(wall_seconds) for stage in self.stats.values()]
+        if self.log_func:
+            for stage in stats:
+                self.log_func(
+                    f"Стадия {stage['stage']}: {stage['items']} элементов, "
+                    f"{stage['items_per_second']} элементов/с, загрузка {stage['utilization']:.0%}"
+                )
+        return {"added": self.added, "skipped": self.skipped, "stages": stats}
+
+
+def add_sources_to_store(sources, config, log_func=None, force=False, concurrency=None):
+    """
+    Пакетно добавляет источники (файлы и URL) в векторное хранилище через потоковый конвейер.
+
+    Хранилище открывается и инициализируется один раз; для каждого изменившегося
+    источника выполняется одно удаление старых записей перед первой записью новых
+    частей. Источники, не изменившиеся с прошлой загрузки, пропускаются.
+
+    Args:
+        sources (iterable): Пары (путь до файла или URL, тег).
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+        force (bool): Перезагрузить все источники независимо от манифеста.
+        concurrency (int, optional): Количество потоков загрузки
+            (по умолчанию ingest.fetch_concurrency).
+
+    Returns:
+        dict: Количество загруженных и пропущенных источников и статистика стадий.
+    """
+    vectorstore = get_vectorstore(config, log_func)
+    initialize_database(vectorstore, config.vector_db.persist_directory, log_func)
+
+    pipeline = IngestPipeline(vectorstore, config, log_func=log_func, force=force, concurrency=concurrency)
+    result = pipeline.run(sources)
+
+    if log_func:
+        log_func(
+            f"Пакетное добавление завершено. Загружено: {result['added']}, "
+            f"без изменений: {result['skipped']}."
+        )
+    return result
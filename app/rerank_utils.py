@@ -0,0 +1,213 @@
+# app/rerank_utils.py
+
+import threading
+import time
+
+from app.search_utils import search_documents
+
+# Общий для процесса экземпляр переранжировщика
+_reranker = None
+_reranker_lock = threading.Lock()
+
+
+class Reranker:
+    """
+    Переранжирование найденных частей документов локальной моделью cross-encoder на CPU.
+
+    Пары (запрос, часть) оцениваются пачками по batch_size. Время оценки одной пары
+    сглаживается (EWMA); если оценка всех кандидатов не укладывается в latency_budget_ms,
+    переранжируются только первые кандидаты, которые в него укладываются (остальные
+    отбрасываются), а если их меньше top_n — переранжирование пропускается и
+    используется исходный порядок.
+
+    Первый вызов модели (прогрев) в оценку не входит. Чтобы оценка могла восстановиться
+    после случайно медленного вызова, каждый probe_every-й пропуск или пропуск спустя
+    probe_seconds после последнего замера заменяется пробным переранжированием top_n
+    кандидатов.
+    """
+
+    def __init__(self, model_name, batch_size=16, max_length=512, latency_budget_ms=300, smoothing=0.2,
+                 probe_every=20, probe_seconds=60):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.latency_budget_ms = latency_budget_ms
+        self.smoothing = smoothing
+        self.probe_every = probe_every
+        self.probe_seconds = probe_seconds
+        self.pair_seconds = None
+        self.reranked = 0
+        self.truncated = 0
+        self.skipped = 0
+        self.probes = 0
+        self._warmed_up = False
+        self._skips_since_measure = 0
+        self._last_measure = time.monotonic()
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _get_model(self):
+        with self._lock:
+            if self._model is None:
+                try:
+                    from sentence_transformers import CrossEncoder
+                except ImportError as e:
+                    raise RuntimeError(
+                        "Для переранжирования нужен пакет sentence-transformers "
+                        "(pip install sentence-transformers)"
+                    ) from e
+                self._model = CrossEncoder(self.model_name, max_length=self.max_length, device="cpu")
+            return self._model
+
+    def _affordable(self, candidates):
+        # Количество кандидатов, которое укладывается в бюджет по текущей оценке
+        if not self.latency_budget_ms or self.pair_seconds is None:
+            return candidates
+        return min(candidates, int(self.latency_budget_ms / 1000 / self.pair_seconds))
+
+    def _should_probe(self):
+        # Пробный замер после серии пропусков или по прошествии probe_seconds
+        return (
+            self._skips_since_measure + 1 >= self.probe_every
+            or time.monotonic() - self._last_measure >= self.probe_seconds
+        )
+
+    def rerank(self, query, results, top_n, log_func=None):
+        """
+        Переранжирует результаты поиска и возвращает top_n лучших.
+
+        Args:
+            query (str): Поисковой запрос.
+            results (list): Результаты поиска в формате {content, metadata, ...}, от лучшего к худшему.
+            top_n (int): Количество возвращаемых результатов.
+            log_func (callable, optional): Функция для логирования.
+
+        Returns:
+            list: Результаты с оценкой rerank_score, от лучшего к худшему
+                (без оценки, если переранжирование пропущено).
+        """
+        if len(results) <= 1:
+            return results[:top_n]
+
+        count = self._affordable(len(results))
+        if count < min(top_n, len(results)):
+            if not self._should_probe():
+                self.skipped += 1
+                self._skips_since_measure += 1
+                if log_func:
+                    log_func(
+                        f"Переранжирование пропущено: {len(results)} кандидатов не укладываются "
+                        f"в бюджет {self.latency_budget_ms} мс."
+                    )
+                return results[:top_n]
+            count = min(top_n, len(results))
+            self.probes += 1
+        if count < len(results):
+            self.truncated += 1
+
+        model = self._get_model()
+        candidates = results[:count]
+        started = time.perf_counter()
+        scores = model.predict(
+            [(query, doc["content"]) for doc in candidates],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        elapsed = time.perf_counter() - started
+
+        pair_seconds = elapsed / len(candidates)
+        if not self._warmed_up:
+            # Первый вызов модели заметно медленнее остальных и в оценку не входит
+            self._warmed_up = True
+        elif self.pair_seconds is None:
+            self.pair_seconds = pair_seconds
+        else:
+            self.pair_seconds += self.smoothing * (pair_seconds - self.pair_seconds)
+        self._skips_since_measure = 0
+        self._last_measure = time.monotonic()
+        self.reranked += 1
+
+        if log_func:
+            log_func(f"Переранжировано {len(candidates)} кандидатов за {elapsed * 1000:.1f} мс.")
+
+        scored = [{**doc, "rerank_score": float(score)} for doc, score in zip(candidates, scores)]
+        scored.sort(key=lambda doc: doc["rerank_score"], reverse=True)
+        return scored[:top_n]
+
+    def stats(self):
+        """
+        Возвращает счётчики переранжирования и оценку времени на одну пару.
+
+        Returns:
+            dict: Статистика переранжировщика.
+        """
+        return {
+            "model": self.model_name,
+            "reranked": self.reranked,
+            "truncated": self.truncated,
+            "skipped": self.skipped,
+            "probes": self.probes,
+            "pair_ms": round(self.pair_seconds * 1000, 3) if self.pair_seconds is not None else None,
+            "latency_budget_ms": self.latency_budget_ms,
+        }
+
+
+def get_reranker(config):
+    """
+    Возвращает общий для процесса переранжировщик, создавая его при первом обращении.
+    Модель загружается при первом переранжировании.
+
+    Args:
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        Reranker: Переранжировщик.
+    """
+    global _reranker
+    rerank = config.rerank
+    with _reranker_lock:
+        if _reranker is None or _reranker.model_name != rerank.model:
+            _reranker = Reranker(
+                rerank.model,
+                batch_size=rerank.batch_size,
+                max_length=rerank.max_length,
+                latency_budget_ms=rerank.latency_budget_ms
+            )
+        return _reranker
+
+
+def get_rerank_stats():
+    """
+    Возвращает статистику переранжировщика или None, если он не создавался.
+
+    Returns:
+        dict: Статистика переранжировщика.
+    """
+    with _reranker_lock:
+        return _reranker.stats() if _reranker is not None else None
+
+
+def search_and_rerank(query, tag, config, log_func=None, candidates=None, top_n=None):
+    """
+    Находит candidates кандидатов и оставляет top_n лучших после переранжирования.
+    Если переранжирование выключено (rerank.enabled), выполняется обычный поиск.
+
+    Args:
+        query (str): Поисковой запрос.
+        tag (str): Тег для фильтрации (опционально).
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+        candidates (int, optional): Количество кандидатов (по умолчанию rerank.candidates).
+        top_n (int, optional): Количество результатов (по умолчанию rerank.top_n).
+
+    Returns:
+        list: Результаты поиска, от лучшего к худшему.
+    """
+    rerank = config.rerank
+    if not rerank.enabled:
+        return search_documents(query=query, tag=tag, config=config, log_func=log_func)
+
+    results = search_documents(
+        query=query, tag=tag, config=config, log_func=log_func, k=candidates or rerank.candidates
+    )
+    return get_reranker(config).rerank(query, results, top_n or rerank.top_n, log_func=log_func)
@@ -1,57 +1,328 @@
-from langchain_community.vectorstores import Chroma
-from langchain_nomic.embeddings import NomicEmbeddings
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy as np
+from langchain_chroma.vectorstores import maximal_marginal_relevance
+from app.cache_utils import embed_queries
+from app.store_utils import get_vectorstore, get_lexical_index
 
-def search_documents(query, tag, config, log_func=None):
+# Общий пул потоков для параллельного поиска по разделам хранилища
+_scatter_pool = None
+_scatter_pool_workers = 0
+_scatter_pool_lock = threading.Lock()
+
+
+def _tag_filter(tag):
+    """
+    Возвращает фильтр Chroma по тегу или None для поиска без фильтра (тег не указан или "all").
+    """
+    if tag and tag.lower() != "all":
+        return {"tag": tag}
+    return None
+
+
+def _search_options(config, k=None, max_distance=None, mmr=None, fetch_k=None, mmr_lambda=None):
+    """
+    Дополняет параметры векторного поиска значениями по умолчанию из секции search конфигурации.
+    """
+    search = config.search
+    return {
+        "k": k or search.k,
+        "max_distance": max_distance if max_distance is not None else search.max_distance,
+        "mmr": search.mmr if mmr is None else mmr,
+        "fetch_k": fetch_k or search.fetch_k,
+        "mmr_lambda": mmr_lambda if mmr_lambda is not None else search.mmr_lambda,
+        "scatter_workers": config.vector_db.scatter_workers,
+    }
+
+
+def _get_scatter_pool(workers):
+    global _scatter_pool, _scatter_pool_workers
+    with _scatter_pool_lock:
+        if _scatter_pool is None or _scatter_pool_workers != workers:
+            if _scatter_pool is not None:
+                _scatter_pool.shutdown(wait=False)
+            _scatter_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scatter-worker")
+            _scatter_pool_workers = workers
+        return _scatter_pool
+
+
+def _shutdown_scatter_pool():
+    global _scatter_pool
+    with _scatter_pool_lock:
+        if _scatter_pool is not None:
+            _scatter_pool.shutdown()
+            _scatter_pool = None
+
+
+atexit.register(_shutdown_scatter_pool)
+
+
+def _targets(vectorstore, tag):
+    """
+    Возвращает коллекции для поиска и фильтр по тегу для каждой: в хранилище,
+    разделённом по тегам, — раздел тега или все разделы без фильтра, иначе —
+    единственную коллекцию с фильтром по тегу.
+    """
+    if hasattr(vectorstore, "route"):
+        return [(partition._collection, None) for partition in vectorstore.route(tag)]
+    return [(vectorstore._collection, _tag_filter(tag))]
+
+
+def _query_collection(collection, where, vectors, n_results, with_embeddings):
+    """
+    Выполняет многозапросный поиск в одной коллекции.
+
+    Returns:
+        list: Для каждого запроса список пар (документ {id, content, metadata, distance}, эмбеддинг).
+    """
+    include = ["documents", "metadatas", "distances"]
+    if with_embeddings:
+        include.append("embeddings")
+    response = collection.query(
+        query_embeddings=vectors,
+        n_results=n_results,
+        where=where,
+        include=include
+    )
+    results = []
+    for position in range(len(vectors)):
+        embeddings = response["embeddings"][position] if with_embeddings else [None] * len(response["ids"][position])
+        results.append([
+            ({"id": chunk_id, "content": content, "metadata": metadata or {}, "distance": distance}, embedding)
+            for chunk_id, content, metadata, distance, embedding in zip(
+                response["ids"][position],
+                response["documents"][position],
+                response["metadatas"][position],
+                response["distances"][position],
+                embeddings
+            )
+        ])
+    return results
+
+
+def _query_vectors(vectorstore, vectors, tag, k, max_distance=None, mmr=False, fetch_k=20, mmr_lambda=0.5,
+                   scatter_workers=4):
+    """
+    Выполняет векторный поиск для нескольких эмбеддингов запросов одним обращением
+    к каждой коллекции. Если коллекций несколько (поиск по всем разделам), они
+    опрашиваются параллельно, а результаты объединяются в общий top-k по расстоянию.
+
+    Args:
+        vectorstore: Экземпляр векторного хранилища.
+        vectors (list): Эмбеддинги запросов.
+        tag (str): Тег для фильтрации (None или "all" — без фильтра).
+        k (int): Количество результатов на запрос.
+        max_distance (float, optional): Результаты с большим расстоянием отбрасываются.
+        mmr (bool): Отбор результатов по Maximal Marginal Relevance.
+        fetch_k (int): Количество кандидатов для MMR.
+        mmr_lambda (float): Баланс релевантности (1) и разнообразия (0) для MMR.
+        scatter_workers (int): Количество потоков для параллельного опроса разделов.
+
+    Returns:
+        list: Для каждого запроса список документов в формате {id, content, metadata, distance},
+            от ближайшего к дальнему (для MMR — в порядке отбора).
+    """
+    n_results = max(fetch_k, k) if mmr else k
+    targets = _targets(vectorstore, tag)
+    if len(targets) > 1:
+        pool = _get_scatter_pool(max(1, scatter_workers))
+        futures = [
+            pool.submit(_query_collection, collection, where, vectors, n_results, mmr)
+            for collection, where in targets
+        ]
+        gathered = [future.result() for future in futures]
+    else:
+        gathered = [
+            _query_collection(collection, where, vectors, n_results, mmr)
+            for collection, where in targets
+        ]
+
+    results = []
+    for position, vector in enumerate(vectors):
+        merged = [pair for collection_results in gathered for pair in collection_results[position]]
+        if len(gathered) > 1:
+            merged.sort(key=lambda pair: pair[0]["distance"])
+            merged = merged[:n_results]
+        if max_distance is not None:
+            merged = [pair for pair in merged if pair[0]["distance"] <= max_distance]
+        candidates = [doc for doc, _ in merged]
+        if mmr and candidates:
+            selected = maximal_marginal_relevance(
+                np.array(vector, dtype=np.float32), [embedding for _, embedding in merged], lambda_mult=mmr_lambda, k=k
+            )
+            candidates = [candidates[i] for i in selected]
+        results.append(candidates[:k])
+    return results
+
+
+def _lexical_search(vectorstore, lexical_index, query, tag, k):
+    """
+    Выполняет полнотекстовый поиск (BM25) и дополняет найденные части текстом
+    и метаданными из Chroma.
+
+    Returns:
+        list: Документы в формате {id, content, metadata, bm25}, от лучшего к худшему.
+    """
+    tag_filter = _tag_filter(tag)
+    hits = lexical_index.search(query, k=k, tag=tag_filter["tag"] if tag_filter else None)
+    if not hits:
+        return []
+    ids = [chunk_id for chunk_id, _ in hits]
+    found = {}
+    for collection, _ in _targets(vectorstore, tag):
+        response = collection.get(ids=ids, include=["documents", "metadatas"])
+        for chunk_id, content, metadata in zip(response["ids"], response["documents"], response["metadatas"]):
+            found[chunk_id] = (content, metadata)
+    return [
+        {"id": chunk_id, "content": found[chunk_id][0], "metadata": found[chunk_id][1] or {}, "bm25": rank}
+        for chunk_id, rank in hits
+        if chunk_id in found
+    ]
+
+
+def reciprocal_rank_fusion(result_lists, k, rrf_k=60):
+    """
+    Объединяет ранжированные списки результатов методом reciprocal rank fusion:
+    оценка документа — сумма 1 / (rrf_k + позиция) по всем спискам, где он встречается.
+
+    Args:
+        result_lists (list): Списки документов с полем id, каждый от лучшего к худшему.
+        k (int): Количество результатов.
+        rrf_k (int): Сглаживающая константа RRF.
+
+    Returns:
+        list: Документы с оценкой score (поля из разных списков объединяются), от лучшего к худшему.
+    """
+    fused = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            entry = fused.setdefault(doc["id"], {**doc, "score": 0.0})
+            for key, value in doc.items():
+                entry.setdefault(key, value)
+            entry["score"] += 1.0 / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda doc: doc["score"], reverse=True)[:k]
+
+
+def _hybrid_search(vectorstore, lexical_index, queries, vectors, tag, options, config):
+    """
+    Гибридный поиск для нескольких запросов с одним тегом: векторный и полнотекстовый
+    поиск по hybrid_candidates кандидатов каждый, объединение через RRF.
+    """
+    k = options["k"]
+    candidates = max(k, config.search.hybrid_candidates)
+    vector_results = _query_vectors(vectorstore, vectors, tag, **{**options, "k": candidates})
+    return [
+        reciprocal_rank_fusion(
+            [vector_docs, _lexical_search(vectorstore, lexical_index, query, tag, candidates)],
+            k,
+            rrf_k=config.search.rrf_k
+        )
+        for query, vector_docs in zip(queries, vector_results)
+    ]
+
+
+def search_documents(query, tag, config, log_func=None, k=None, max_distance=None, mmr=None,
+                     fetch_k=None, mmr_lambda=None, mode=None):
     """
     Выполняет поиск документов в векторном хранилище.
 
+    Параметры, не указанные явно, берутся из секции search конфигурации.
+
     Args:
         query (str): Поисковой запрос.
         tag (str): Тег для фильтрации (опционально).
         config (Config): Конфигурационный объект.
         log_func (callable, optional): Функция для логирования.
+        k (int, optional): Количество результатов.
+        max_distance (float, optional): Максимальное расстояние до запроса.
+        mmr (bool, optional): Диверсификация результатов по MMR.
+        fetch_k (int, optional): Количество кандидатов для MMR.
+        mmr_lambda (float, optional): Баланс релевантности и разнообразия для MMR.
+        mode (str, optional): "vector" — векторный поиск, "hybrid" — векторный и
+            полнотекстовый (BM25) поиск, объединённые через RRF.
 
     Returns:
-        list: Найденные документы в формате {content, metadata}.
+        list: Найденные документы в формате {id, content, metadata, distance}; в режиме
+            hybrid также score (RRF) и bm25, а distance есть только у найденных векторным поиском.
     """
     try:
-        # Инициализация векторного хранилища
-        embeddings = NomicEmbeddings(
-            model=config.vector_db.embedding_model,
-            inference_mode=config.vector_db.inference_mode
-        )
-        vectorstore = Chroma(
-            persist_directory=config.vector_db.persist_directory,
-            embedding_function=embeddings
-        )
+        # Общее для процесса векторное хранилище
+        vectorstore = get_vectorstore(config, log_func)
+        options = _search_options(config, k, max_distance, mmr, fetch_k, mmr_lambda)
 
         # Выполняем поиск
-        results = []
-        if tag:
-            if tag.lower() == "all":
-                results = vectorstore.similarity_search(query, k=10)
-                if log_func:
-                    log_func("Поиск по всей базе данных выполнен успешно.")
-            else:
-                filter_dict = {"tag": tag}
-                results = vectorstore.similarity_search(query, k=10, filter=filter_dict)
-                if log_func:
-                    log_func(f"Поиск с фильтром по тегу '{tag}' выполнен успешно.")
+        vector = vectorstore.embeddings.embed_query(query)
+        if (mode or config.search.mode) == "hybrid":
+            lexical_index = get_lexical_index(config, log_func)
+            results = _hybrid_search(vectorstore, lexical_index, [query], [vector], tag, options, config)[0]
         else:
-            results = vectorstore.similarity_search(query, k=10)
-            if log_func:
+            results = _query_vectors(vectorstore, [vector], tag, **options)[0]
+        if log_func:
+            if _tag_filter(tag):
+                log_func(f"Поиск с фильтром по тегу '{tag}' выполнен успешно.")
+            elif tag:
+                log_func("Поиск по всей базе данных выполнен успешно.")
+            else:
                 log_func("Поиск без фильтрации по тегу выполнен успешно.")
-
-        # Форматируем результаты
-        return [
-            {
-                "content": doc.page_content,
-                "metadata": doc.metadata
-            }
-            for doc in results
-        ]
+        return results
     except Exception as e:
         if log_func:
             log_func(f"Ошибка при выполнении поиска: {e}")
-        raise e
\ No newline at end of file
+        raise e
+
+
+def search_documents_batch(queries, config, log_func=None, k=None, max_distance=None, mmr=None,
+                           fetch_k=None, mmr_lambda=None, mode=None):
+    """
+    Выполняет несколько поисковых запросов: эмбеддинги всех запросов вычисляются одним
+    вызовом модели, а запросы с одинаковым тегом отправляются в Chroma одним
+    многозапросным обращением.
+
+    Args:
+        queries (list): Запросы в формате {"query": str, "tag": str или None}.
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+        k, max_distance, mmr, fetch_k, mmr_lambda, mode: Параметры поиска, как в search_documents.
+
+    Returns:
+        list: Для каждого запроса (в исходном порядке) список документов в формате,
+            как в search_documents.
+    """
+    try:
+        if not queries:
+            return []
+        vectorstore = get_vectorstore(config, log_func)
+        options = _search_options(config, k, max_distance, mmr, fetch_k, mmr_lambda)
+        vectors = embed_queries(vectorstore.embeddings, [item["query"] for item in queries])
+
+        # Группируем запросы по фильтру тега
+        groups = {}
+        for index, item in enumerate(queries):
+            tag_filter = _tag_filter(item.get("tag"))
+            key = tag_filter["tag"] if tag_filter else None
+            groups.setdefault(key, []).append(index)
+
+        hybrid = (mode or config.search.mode) == "hybrid"
+        lexical_index = get_lexical_index(config, log_func) if hybrid else None
+        results = [None] * len(queries)
+        for tag, indexes in groups.items():
+            group_vectors = [vectors[index] for index in indexes]
+            if hybrid:
+                group_queries = [queries[index]["query"] for index in indexes]
+                group_results = _hybrid_search(
+                    vectorstore, lexical_index, group_queries, group_vectors, tag, options, config
+                )
+            else:
+                group_results = _query_vectors(vectorstore, group_vectors, tag, **options)
+            for index, documents in zip(indexes, group_results):
+                results[index] = documents
+
+        if log_func:
+            log_func(f"Пакетный поиск выполнен: {len(queries)} запрос(ов), {len(groups)} групп(ы) по тегам.")
+        return results
+    except Exception as e:
+        if log_func:
+            log_func(f"Ошибка при выполнении пакетного поиска: {e}")
+        raise e
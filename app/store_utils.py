@@ -0,0 +1,480 @@
+# app/store_utils.py
+
+import atexit
+import hashlib
+import os
+import threading
+import time
+
+import chromadb
+from langchain_chroma import Chroma
+from langchain_nomic.embeddings import NomicEmbeddings
+from app.cache_utils import EmbeddingCache, QueryEmbeddingCache, CachedEmbeddings, AnswerCache
+from app.db_utils import LexicalIndex, sync_lexical_index
+from app.manifest_utils import IngestManifest
+
+# Реестр общих объектов процесса: одна модель эмбеддингов и одно векторное
+# хранилище на конфигурацию vector_db
+_lock = threading.RLock()
+_embeddings = {}
+_embedding_caches = {}
+_query_caches = {}
+_answer_caches = {}
+_clients = {}
+_manifests = {}
+_lexical_indexes = {}
+_lexical_index_locks = {}
+_vectorstores = {}
+
+# Локальная модель эмбеддингов (нативный код gpt4all/llama.cpp) не рассчитана
+# на одновременные вызовы из нескольких потоков
+_local_embed_lock = threading.Lock()
+
+
+class LocalNomicEmbeddings(NomicEmbeddings):
+    """
+    Эмбеддинги Nomic в локальном режиме: вызовы модели выполняются по одному.
+    Потоки векторизации и поиска при этом продолжают параллельно готовить пачки
+    и обращаться к кэшу.
+    """
+
+    def embed(self, *args, **kwargs):
+        with _local_embed_lock:
+            return super().embed(*args, **kwargs)
+
+
+def _store_key(config):
+    """
+    Формирует ключ реестра по секции vector_db конфигурации.
+
+    Args:
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        tuple: Ключ для словарей реестра.
+    """
+    vector_db = config.vector_db
+    return (
+        vector_db.persist_directory,
+        vector_db.embedding_model,
+        vector_db.inference_mode,
+        vector_db.dimensionality,
+    )
+
+
+def get_embeddings(config):
+    """
+    Возвращает общую для процесса модель эмбеддингов, создавая её при первом обращении.
+    Если включён кэш эмбеддингов или кэш запросов, модель оборачивается в CachedEmbeddings.
+
+    Args:
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        Embeddings: Модель эмбеддингов.
+    """
+    vector_db = config.vector_db
+    key = (vector_db.embedding_model, vector_db.inference_mode, vector_db.dimensionality)
+    with _lock:
+        embeddings = _embeddings.get(key)
+        if embeddings is None:
+            embeddings_class = LocalNomicEmbeddings if vector_db.inference_mode == "local" else NomicEmbeddings
+            embeddings = embeddings_class(
+                model=vector_db.embedding_model,
+                inference_mode=vector_db.inference_mode,
+                dimensionality=vector_db.dimensionality
+            )
+            if config.embedding_cache.enabled or config.query_cache.enabled:
+                embeddings = CachedEmbeddings(
+                    embeddings,
+                    get_embedding_cache(config) if config.embedding_cache.enabled else None,
+                    model=vector_db.embedding_model,
+                    dimensionality=vector_db.dimensionality,
+                    query_cache=get_query_cache(config) if config.query_cache.enabled else None
+                )
+            _embeddings[key] = embeddings
+        return embeddings
+
+
+def warm_up_embeddings(config, log_func=None):
+    """
+    Загружает модель эмбеддингов пробным вызовом, чтобы первый поиск не ждал загрузки
+    (в локальном режиме NomicEmbeddings загружает модель при первом вычислении).
+
+    Args:
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+
+    Returns:
+        bool: True, если модель загружена.
+    """
+    embeddings = get_embeddings(config)
+    # Вызов в обход кэша запросов: закэшированный запрос не загрузил бы модель
+    model = embeddings.embeddings if isinstance(embeddings, CachedEmbeddings) else embeddings
+    try:
+        started = time.perf_counter()
+        model.embed_query("warm-up")
+        if log_func:
+            log_func(
+                f"Модель эмбеддингов {config.vector_db.embedding_model} загружена "
+                f"за {time.perf_counter() - started:.1f} с."
+            )
+        return True
+    except Exception as e:
+        if log_func:
+            log_func(f"Не удалось прогреть модель эмбеддингов: {e}")
+        return False
+
+
+def get_embedding_cache(config):
+    """
+    Возвращает общий для процесса постоянный кэш эмбеддингов.
+
+    Args:
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        EmbeddingCache: Кэш эмбеддингов.
+    """
+    path = config.embedding_cache.path
+    with _lock:
+        cache = _embedding_caches.get(path)
+        if cache is None:
+            cache = EmbeddingCache(path, max_entries=config.embedding_cache.max_entries)
+            _embedding_caches[path] = cache
+        return cache
+
+
+def get_query_cache(config):
+    """
+    Возвращает общий для процесса кэш эмбеддингов поисковых запросов.
+
+    Args:
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        QueryEmbeddingCache: Кэш эмбеддингов запросов.
+    """
+    query_cache = config.query_cache
+    key = (query_cache.max_entries, query_cache.ttl_seconds, query_cache.persist_path)
+    with _lock:
+        cache = _query_caches.get(key)
+        if cache is None:
+            cache = QueryEmbeddingCache(
+                max_entries=query_cache.max_entries,
+                ttl_seconds=query_cache.ttl_seconds,
+                persist_path=query_cache.persist_path
+            )
+            _query_caches[key] = cache
+        return cache
+
+
+def get_answer_cache(config):
+    """
+    Возвращает общий для процесса семантический кэш ответов модели.
+
+    Args:
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        AnswerCache: Кэш ответов.
+    """
+    answer_cache = config.answer_cache
+    key = (answer_cache.similarity_threshold, answer_cache.max_entries, answer_cache.ttl_seconds)
+    with _lock:
+        cache = _answer_caches.get(key)
+        if cache is None:
+            cache = AnswerCache(
+                similarity_threshold=answer_cache.similarity_threshold,
+                max_entries=answer_cache.max_entries,
+                ttl_seconds=answer_cache.ttl_seconds
+            )
+            _answer_caches[key] = cache
+        return cache
+
+
+def invalidate_answers(tag=None):
+    """
+    Удаляет из всех кэшей ответов записи, зависящие от тега перезагруженных источников.
+
+    Args:
+        tag (str, optional): Тег; без тега кэши очищаются полностью.
+    """
+    with _lock:
+        caches = list(_answer_caches.values())
+    for cache in caches:
+        cache.invalidate(tag)
+
+
+def get_cache_stats():
+    """
+    Возвращает статистику всех открытых кэшей эмбеддингов и ответов.
+
+    Returns:
+        dict: Статистика по каждому кэшу.
+    """
+    with _lock:
+        return {
+            "embedding_cache": [cache.stats() for cache in _embedding_caches.values()],
+            "query_cache": [cache.stats() for cache in _query_caches.values()],
+            "answer_cache": [cache.stats() for cache in _answer_caches.values()],
+        }
+
+
+PARTITION_PREFIX = "tag_"
+
+
+def partition_name(tag):
+    """
+    Возвращает имя коллекции Chroma для тега (имена коллекций ограничены по символам,
+    поэтому используется хэш тега).
+
+    Args:
+        tag (str): Тег.
+
+    Returns:
+        str: Имя коллекции.
+    """
+    return PARTITION_PREFIX + hashlib.sha1(tag.encode("utf-8")).hexdigest()[:24]
+
+
+class PartitionedVectorStore:
+    """
+    Векторное хранилище, разделённое на коллекции Chroma по тегам.
+
+    Коллекция тега создаётся при первой записи в неё; тег хранится в метаданных
+    коллекции (partition_tag), по ним перечисляются существующие разделы. Список
+    разделов кэшируется и перечитывается из Chroma не чаще раза в refresh_seconds
+    (разделы, созданные другим процессом) или при обращении к неизвестному тегу;
+    разделы этого процесса регистрируются при создании.
+    """
+
+    def __init__(self, client, embeddings, log_func=None, refresh_seconds=30):
+        self.client = client
+        self.embeddings = embeddings
+        self.log_func = log_func
+        self.refresh_seconds = refresh_seconds
+        self._partitions = {}
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def _open(self, tag):
+        return Chroma(
+            client=self.client,
+            collection_name=partition_name(tag),
+            embedding_function=self.embeddings,
+            collection_metadata={"partition_tag": tag}
+        )
+
+    def refresh(self):
+        """
+        Перечитывает список разделов из Chroma (например, созданных другим процессом).
+        """
+        found = {}
+        for collection in self.client.list_collections():
+            if isinstance(collection, str):
+                collection = self.client.get_collection(collection)
+            tag = (collection.metadata or {}).get("partition_tag")
+            if tag is not None and collection.name.startswith(PARTITION_PREFIX):
+                found[tag] = collection.name
+        with self._lock:
+            for tag in found:
+                if tag not in self._partitions:
+                    self._partitions[tag] = self._open(tag)
+            self._refreshed_at = time.monotonic()
+
+    def partition(self, tag, create=True):
+        """
+        Возвращает раздел тега.
+
+        Args:
+            tag (str): Тег.
+            create (bool): Создать раздел, если его нет.
+
+        Returns:
+            Chroma: Раздел или None, если его нет и create=False.
+        """
+        with self._lock:
+            vectorstore = self._partitions.get(tag)
+        if vectorstore is None and not create:
+            self.refresh()
+            with self._lock:
+                return self._partitions.get(tag)
+        if vectorstore is None:
+            with self._lock:
+                vectorstore = self._partitions.get(tag)
+                if vectorstore is None:
+                    vectorstore = self._open(tag)
+                    self._partitions[tag] = vectorstore
+                    if self.log_func:
+                        self.log_func(f"Создан раздел хранилища для тега: {tag}")
+        return vectorstore
+
+    def partitions(self):
+        """
+        Возвращает все существующие разделы.
+
+        Returns:
+            dict: Отображение тег -> раздел.
+        """
+        with self._lock:
+            refreshed_at = self._refreshed_at
+        if refreshed_at is None or time.monotonic() - refreshed_at >= self.refresh_seconds:
+            self.refresh()
+        with self._lock:
+            return dict(self._partitions)
+
+    def route(self, tag=None):
+        """
+        Возвращает разделы для поиска по тегу: раздел тега или все разделы
+        (тег не указан или "all").
+
+        Args:
+            tag (str, optional): Тег.
+
+        Returns:
+            list: Разделы (Chroma).
+        """
+        if tag and tag.lower() != "all":
+            vectorstore = self.partition(tag, create=False)
+            return [vectorstore] if vectorstore is not None else []
+        return list(self.partitions().values())
+
+
+def get_vectorstore(config, log_func=None):
+    """
+    Возвращает общее для процесса векторное хранилище, создавая его при первом обращении.
+    При vector_db.partition_by_tag хранилище разделено на коллекции по тегам.
+
+    Args:
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+
+    Returns:
+        Chroma | PartitionedVectorStore: Векторное хранилище.
+    """
+    key = _store_key(config) + (config.vector_db.partition_by_tag,)
+    with _lock:
+        vectorstore = _vectorstores.get(key)
+        if vectorstore is None:
+            persist_directory = config.vector_db.persist_directory
+            client = _clients.get(persist_directory)
+            if client is None:
+                client = chromadb.PersistentClient(path=persist_directory)
+                _clients[persist_directory] = client
+            if config.vector_db.partition_by_tag:
+                vectorstore = PartitionedVectorStore(client, get_embeddings(config), log_func=log_func)
+            else:
+                vectorstore = Chroma(
+                    client=client,
+                    embedding_function=get_embeddings(config)
+                )
+            _vectorstores[key] = vectorstore
+            if log_func:
+                log_func(f"Векторное хранилище открыто: {persist_directory}")
+        return vectorstore
+
+
+def get_manifest(config):
+    """
+    Возвращает общий для процесса манифест загрузки, который хранится рядом с базой.
+
+    Args:
+        config (Config): Конфигурационный объект.
+
+    Returns:
+        IngestManifest: Манифест загрузки.
+    """
+    path = os.path.join(config.vector_db.persist_directory, "ingest_manifest.sqlite3")
+    with _lock:
+        manifest = _manifests.get(path)
+        if manifest is None:
+            manifest = IngestManifest(path)
+            _manifests[path] = manifest
+        return manifest
+
+
+def get_lexical_index(config, log_func=None):
+    """
+    Возвращает общий для процесса полнотекстовый индекс частей документов, который
+    хранится рядом с базой. При первом открытии индекс сверяется с коллекцией Chroma
+    и при расхождении перестраивается.
+
+    Args:
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+
+    Returns:
+        LexicalIndex: Полнотекстовый индекс.
+    """
+    path = os.path.join(config.vector_db.persist_directory, "lexical_index.sqlite3")
+    with _lock:
+        lexical_index = _lexical_indexes.get(path)
+        if lexical_index is not None:
+            return lexical_index
+        init_lock = _lexical_index_locks.setdefault(path, threading.Lock())
+    vectorstore = get_vectorstore(config, log_func)
+
+    # Сверка может перестроить индекс по всей коллекции, поэтому выполняется под
+    # отдельной блокировкой индекса, а не под общей блокировкой реестра
+    with init_lock:
+        with _lock:
+            lexical_index = _lexical_indexes.get(path)
+        if lexical_index is not None:
+            return lexical_index
+        lexical_index = LexicalIndex(path)
+        try:
+            sync_lexical_index(vectorstore, lexical_index, log_func=log_func)
+        except Exception:
+            lexical_index.close()
+            raise
+        with _lock:
+            _lexical_indexes[path] = lexical_index
+        return lexical_index
+
+
+def close_vector_stores(log_func=None):
+    """
+    Закрывает все открытые векторные хранилища и освобождает модели эмбеддингов.
+
+    Args:
+        log_func (callable, optional): Функция для логирования.
+    """
+    with _lock:
+        for persist_directory, client in _clients.items():
+            try:
+                # У chromadb нет публичного close: останавливаем общую систему клиента
+                # и убираем её из кэша, чтобы повторное открытие создало новую
+                clear_system_cache = getattr(client, "clear_system_cache", None)
+                if clear_system_cache is not None:
+                    clear_system_cache()
+                if log_func:
+                    log_func(f"Векторное хранилище закрыто: {persist_directory}")
+            except Exception as e:
+                if log_func:
+                    log_func(f"Ошибка при закрытии векторного хранилища {persist_directory}: {e}")
+        for cache in _embedding_caches.values():
+            if log_func:
+                log_func(f"Статистика кэша эмбеддингов: {cache.stats()}")
+            cache.close()
+        for manifest in _manifests.values():
+            manifest.close()
+        for lexical_index in _lexical_indexes.values():
+            lexical_index.close()
+        for cache in _query_caches.values():
+            try:
+                cache.close()
+            except Exception as e:
+                if log_func:
+                    log_func(f"Ошибка при сохранении кэша запросов: {e}")
+        _vectorstores.clear()
+        _clients.clear()
+        _embeddings.clear()
+        _embedding_caches.clear()
+        _query_caches.clear()
+        _answer_caches.clear()
+        _manifests.clear()
+        _lexical_indexes.clear()
+
+
+atexit.register(close_vector_stores)
@@ -3,6 +3,11 @@ from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
 import sqlite3
 import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
 
 router = APIRouter()
 
@@ -16,47 +21,503 @@ DB_PATH = os.path.join("chroma_db", "chroma.sqlite3")
 if not os.path.exists(DB_PATH):
     raise RuntimeError(f"База данных не найдена по пути: {DB_PATH}")
 
+# Полнотекстовый индекс для поиска по таблице хранится отдельно от базы Chroma
+SEARCH_INDEX_PATH = os.path.join("chroma_db", "table_search.sqlite3")
 
-def get_db_connection():
+# Как часто (в секундах) индекс поиска догоняет изменения базы
+SEARCH_SYNC_SECONDS = 10
+
+# Размер страницы таблицы
+PAGE_SIZE = 50
+
+# Время жизни кэша количества записей (по строке поиска)
+COUNT_CACHE_SECONDS = 30
+_count_cache = {}
+_count_cache_lock = threading.Lock()
+
+_search_index = None
+_search_index_lock = threading.Lock()
+
+
+class ConnectionPool:
     """
-    Устанавливает соединение с базой данных.
+    Пул соединений с базой Chroma для маршрутов таблицы.
+
+    Страницы просмотра и поиска используют соединения только для чтения
+    (URI mode=ro, query_only), которые переиспользуются между запросами. Изменения
+    выполняются через одно соединение для записи короткими транзакциями BEGIN IMMEDIATE.
+    При создании пула база переводится в режим WAL.
+    У всех соединений задан busy_timeout, поэтому во время загрузки документов запросы
+    ждут освобождения блокировки, а не завершаются ошибкой "database is locked".
     """
-    try:
-        conn = sqlite3.connect(DB_PATH)
+
+    def __init__(self, path, size=4, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._readers = queue.LifoQueue(maxsize=size)
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self._enable_wal()
+
+    def _enable_wal(self):
+        # В режиме WAL чтение не блокируется записью. Режим сохраняется в файле базы,
+        # то есть меняется и для самой Chroma; если база занята, режим остаётся прежним
+        try:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000)
+            try:
+                conn.execute("PRAGMA journal_mode = WAL")
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            pass
+
+    def _connect(self, read_only):
+        if read_only:
+            uri = f"file:{quote(os.path.abspath(self.path))}?mode=ro"
+            conn = sqlite3.connect(
+                uri, uri=True, timeout=self.busy_timeout_ms / 1000, check_same_thread=False
+            )
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn = sqlite3.connect(
+                self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False,
+                isolation_level=None
+            )
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
         conn.row_factory = sqlite3.Row
         return conn
-    except sqlite3.Error as e:
-        raise HTTPException(status_code=500, detail=f"Ошибка подключения к базе данных: {str(e)}")
 
+    @contextmanager
+    def read(self):
+        """
+        Выдаёт соединение только для чтения из пула и возвращает его после использования.
+        """
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            try:
+                conn = self._connect(read_only=True)
+            except sqlite3.Error as e:
+                raise HTTPException(status_code=500, detail=f"Ошибка подключения к базе данных: {str(e)}")
+        try:
+            yield conn
+        except sqlite3.Error:
+            # Соединение после ошибки SQLite в пул не возвращается
+            conn.close()
+            raise
+        else:
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._readers.put_nowait(conn)
+            except queue.Full:
+                conn.close()
 
-@router.get("/", response_class=HTMLResponse)
-async def table_metadata_page(request: Request, page: int = Query(1, ge=1), search: str = Query(None)):
+    @contextmanager
+    def write(self):
+        """
+        Выдаёт соединение для записи внутри транзакции BEGIN IMMEDIATE: транзакция
+        фиксируется при выходе из блока и откатывается при исключении.
+        """
+        with self._write_lock:
+            if self._writer is None:
+                try:
+                    self._writer = self._connect(read_only=False)
+                except sqlite3.Error as e:
+                    raise HTTPException(status_code=500, detail=f"Ошибка подключения к базе данных: {str(e)}")
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            else:
+                conn.execute("COMMIT")
+
+    def close(self):
+        """
+        Закрывает все соединения пула.
+        """
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+
+# Общий пул соединений с базой Chroma
+pool = ConnectionPool(DB_PATH)
+
+
+def close_db_connections():
     """
-    Рендеринг таблицы с данными из таблицы embedding_metadata с поддержкой поиска.
+    Закрывает соединения маршрутов таблицы с базой и индексом поиска.
     """
-    page_size = 50
-    start_index = (page - 1) * page_size
-    end_index = start_index + page_size
+    global _search_index
+    pool.close()
+    with _search_index_lock:
+        if _search_index is not None:
+            _search_index.close()
+            _search_index = None
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
 
-    # Запрос данных с поддержкой поиска
-    if search:
-        query = """
-            SELECT * FROM embedding_metadata
-            WHERE key LIKE ? OR string_value LIKE ?
+class MetadataSearchIndex:
+    """
+    Полнотекстовый индекс (SQLite FTS5) по ключам и строковым значениям таблицы
+    embedding_metadata для поиска в /table.
+
+    Индекс хранит копию строк (id, key, string_value) в отдельном файле. Chroma
+    повторно использует id удалённых записей, поэтому изменения отслеживаются по
+    монотонному embeddings.seq_id (меняется при добавлении и обновлении записи):
+    строки записей с seq_id больше последнего проиндексированного переиндексируются.
+    Если после этого количество строк расходится с базой (записи удалялись), из
+    индекса удаляются записи, которых больше нет в таблице embeddings.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_sync = 0.0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS metadata_rows (
+                rowid INTEGER PRIMARY KEY,
+                id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                string_value TEXT,
+                UNIQUE (id, key)
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT PRIMARY KEY,
+                value
+            );
+            CREATE VIRTUAL TABLE IF NOT EXISTS metadata_fts USING fts5(
+                key, string_value, content='metadata_rows', content_rowid='rowid',
+                tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS metadata_rows_ai AFTER INSERT ON metadata_rows BEGIN
+                INSERT INTO metadata_fts (rowid, key, string_value)
+                VALUES (new.rowid, new.key, new.string_value);
+            END;
+            CREATE TRIGGER IF NOT EXISTS metadata_rows_ad AFTER DELETE ON metadata_rows BEGIN
+                INSERT INTO metadata_fts (metadata_fts, rowid, key, string_value)
+                VALUES ('delete', old.rowid, old.key, old.string_value);
+            END;
+            """
+        )
+        self._conn.commit()
+
+    def _insert_rows(self, rows):
+        # Без INSERT OR REPLACE: при замене строки триггер удаления из FTS не срабатывает
+        rows = [(row["id"], row["key"], row["string_value"]) for row in rows]
+        self._conn.executemany(
+            "DELETE FROM metadata_rows WHERE id = ? AND key = ?", [row[:2] for row in rows]
+        )
+        self._conn.executemany(
+            "INSERT INTO metadata_rows (id, key, string_value) VALUES (?, ?, ?)", rows
+        )
+
+    def _delete_ids(self, ids):
+        placeholders = ",".join("?" * len(ids))
+        self._conn.execute(f"DELETE FROM metadata_rows WHERE id IN ({placeholders})", ids)
+
+    def _indexed_seq_id(self):
+        row = self._conn.execute("SELECT value FROM sync_state WHERE name = 'seq_id'").fetchone()
+        return row[0] if row else None
+
+    def _set_indexed_seq_id(self, seq_id):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO sync_state (name, value) VALUES ('seq_id', ?)", (seq_id,)
+        )
+
+    def rebuild(self, source_conn):
+        """
+        Перестраивает индекс по всей таблице embedding_metadata.
+
+        Args:
+            source_conn: Соединение с базой Chroma.
+
+        Returns:
+            int: Количество проиндексированных строк.
+        """
+        with self._lock:
+            source_conn.execute("BEGIN")
+            try:
+                seq_id = source_conn.execute("SELECT COALESCE(MAX(seq_id), 0) FROM embeddings").fetchone()[0]
+                cursor = source_conn.execute("SELECT id, key, string_value FROM embedding_metadata")
+                self._conn.execute("DELETE FROM metadata_rows")
+                while True:
+                    rows = cursor.fetchmany(1000)
+                    if not rows:
+                        break
+                    self._insert_rows(rows)
+            finally:
+                source_conn.rollback()
+            self._set_indexed_seq_id(seq_id)
+            self._conn.commit()
+            self.last_sync = time.time()
+            return self._conn.execute("SELECT COUNT(*) FROM metadata_rows").fetchone()[0]
+
+    def sync(self, source_conn):
+        """
+        Переиндексирует записи базы, добавленные или обновлённые после прошлой сверки,
+        и удаляет из индекса записи, удалённые из базы.
+
+        Изменения и количество строк читаются в одной транзакции, чтобы сравнивать
+        индекс с тем же снимком базы. Индекс без сохранённого seq_id (первое открытие)
+        строится целиком.
+
+        Args:
+            source_conn: Соединение с базой Chroma.
+        """
+        with self._lock:
+            indexed_seq_id = self._indexed_seq_id()
+        if indexed_seq_id is None:
+            self.rebuild(source_conn)
+            return
+
+        with self._lock:
+            source_conn.execute("BEGIN")
+            try:
+                source_count = source_conn.execute("SELECT COUNT(*) FROM embedding_metadata").fetchone()[0]
+                changed = source_conn.execute(
+                    "SELECT id, seq_id FROM embeddings WHERE seq_id > ? ORDER BY seq_id", (indexed_seq_id,)
+                )
+                while True:
+                    batch = changed.fetchmany(500)
+                    if not batch:
+                        break
+                    ids = [row["id"] for row in batch]
+                    indexed_seq_id = batch[-1]["seq_id"]
+                    # id мог освободиться и достаться новой записи: старые строки убираются целиком
+                    self._delete_ids(ids)
+                    placeholders = ",".join("?" * len(ids))
+                    self._insert_rows(source_conn.execute(
+                        f"SELECT id, key, string_value FROM embedding_metadata WHERE id IN ({placeholders})",
+                        ids
+                    ).fetchall())
+
+                indexed = self._conn.execute("SELECT COUNT(*) FROM metadata_rows").fetchone()[0]
+                if indexed != source_count:
+                    self._remove_deleted(source_conn)
+            finally:
+                source_conn.rollback()
+            self._set_indexed_seq_id(indexed_seq_id)
+            self._conn.commit()
+            self.last_sync = time.time()
+
+    def _remove_deleted(self, source_conn):
+        # Удаляет из индекса записи, которых больше нет в базе (сверяются только id)
+        last_id = None
+        while True:
+            ids = [
+                row[0] for row in self._conn.execute(
+                    "SELECT DISTINCT id FROM metadata_rows WHERE id > ? ORDER BY id LIMIT 500",
+                    (last_id if last_id is not None else -1,)
+                ).fetchall()
+            ]
+            if not ids:
+                break
+            last_id = ids[-1]
+            placeholders = ",".join("?" * len(ids))
+            existing = {
+                row[0] for row in source_conn.execute(
+                    f"SELECT id FROM embeddings WHERE id IN ({placeholders})", ids
+                ).fetchall()
+            }
+            deleted = [record_id for record_id in ids if record_id not in existing]
+            if deleted:
+                self._delete_ids(deleted)
+
+    def refresh_record(self, source_conn, record_id):
+        """
+        Переиндексирует все строки записи после её изменения.
+
+        Args:
+            source_conn: Соединение с базой Chroma.
+            record_id (int): Идентификатор записи.
+        """
+        rows = source_conn.execute(
+            "SELECT id, key, string_value FROM embedding_metadata WHERE id = ?", (record_id,)
+        ).fetchall()
+        with self._lock:
+            self._conn.execute("DELETE FROM metadata_rows WHERE id = ?", (record_id,))
+            self._insert_rows(rows)
+            self._conn.commit()
+
+    def execute(self, sql, params=()):
+        """
+        Выполняет запрос к индексу и возвращает все строки.
         """
-        cursor.execute(query, (f"%{search}%", f"%{search}%"))
-    else:
-        query = "SELECT * FROM embedding_metadata"
-        cursor.execute(query)
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
 
-    records = cursor.fetchall()
+    def close(self):
+        """
+        Закрывает соединение с файлом индекса.
+        """
+        with self._lock:
+            self._conn.close()
+
+
+def get_search_index():
+    """
+    Возвращает общий для процесса индекс поиска по таблице.
+    """
+    global _search_index
+    with _search_index_lock:
+        if _search_index is None:
+            _search_index = MetadataSearchIndex(SEARCH_INDEX_PATH)
+        return _search_index
+
+
+def match_expression(search):
+    """
+    Преобразует строку поиска в выражение FTS5: каждое слово ищется по префиксу,
+    все слова должны встретиться в ключе или значении.
+
+    Args:
+        search (str): Строка поиска.
+
+    Returns:
+        str: Выражение MATCH или пустая строка, если слов нет.
+    """
+    terms = [term.replace('"', '""') for term in search.split()]
+    return " AND ".join(f'"{term}"*' for term in terms if term.strip('"'))
+
+
+def _search_condition(search):
+    """
+    Возвращает источник строк, условие WHERE и параметры: таблицу базы без поиска
+    или полнотекстовый индекс при поиске.
+    """
+    if not search:
+        return "embedding_metadata", "1 = 1", []
+    return (
+        "metadata_rows",
+        "rowid IN (SELECT rowid FROM metadata_fts WHERE metadata_fts MATCH ?)",
+        [match_expression(search)],
+    )
+
+
+def _execute(cursor, search, sql, params):
+    # Поиск выполняется по индексу, просмотр без поиска — по базе
+    if search:
+        return get_search_index().execute(sql, params)
+    return cursor.execute(sql, params).fetchall()
+
+
+def count_records(cursor, search=None):
+    """
+    Возвращает количество записей embedding_metadata или найденных поиском записей.
+
+    Результат кэшируется на COUNT_CACHE_SECONDS, чтобы листание страниц не
+    пересчитывало всю таблицу.
+
+    Args:
+        cursor: Курсор базы данных.
+        search (str, optional): Строка поиска.
 
-    # Ограничение на текущую страницу
-    paginated_records = records[start_index:end_index]
-    total_pages = (len(records) + page_size - 1) // page_size
+    Returns:
+        int: Количество записей.
+    """
+    now = time.time()
+    with _count_cache_lock:
+        cached = _count_cache.get(search)
+        if cached is not None and now - cached[1] < COUNT_CACHE_SECONDS:
+            return cached[0]
+
+    table, condition, params = _search_condition(search)
+    total = _execute(cursor, search, f"SELECT COUNT(*) FROM {table} WHERE {condition}", params)[0][0]
+    with _count_cache_lock:
+        _count_cache[search] = (total, now)
+    return total
+
+
+def fetch_page(cursor, search=None, after=None, before=None, page_size=PAGE_SIZE):
+    """
+    Возвращает страницу записей с постраничной навигацией по ключу (id, key):
+    страница после курсора after или перед курсором before в порядке (id, key).
+    При поиске записи выбираются из полнотекстового индекса.
+
+    Args:
+        cursor: Курсор базы данных.
+        search (str, optional): Строка поиска.
+        after (tuple, optional): Курсор (id, key) последней записи предыдущей страницы.
+        before (tuple, optional): Курсор (id, key) первой записи следующей страницы.
+        page_size (int): Размер страницы.
+
+    Returns:
+        tuple: (записи страницы, есть ли ещё записи в направлении листания).
+    """
+    table, condition, params = _search_condition(search)
+    order = "id, key"
+    if after is not None:
+        condition += " AND (id, key) > (?, ?)"
+        params += list(after)
+    elif before is not None:
+        condition += " AND (id, key) < (?, ?)"
+        params += list(before)
+        order = "id DESC, key DESC"
+
+    rows = _execute(
+        cursor, search,
+        f"SELECT id, key, string_value FROM {table} WHERE {condition} ORDER BY {order} LIMIT ?",
+        params + [page_size + 1]
+    )
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before is not None:
+        rows.reverse()
+    return rows, has_more
+
+
+@router.get("/", response_class=HTMLResponse)
+def table_metadata_page(
+    request: Request,
+    page: int = Query(1, ge=1),
+    search: str = Query(None),
+    after_id: int = Query(None),
+    after_key: str = Query(None),
+    before_id: int = Query(None),
+    before_key: str = Query(None),
+):
+    """
+    Рендеринг таблицы с данными из таблицы embedding_metadata с поддержкой поиска.
+    Обработчики таблицы синхронные: FastAPI выполняет их в пуле потоков,
+    поэтому запросы к SQLite не блокируют цикл событий.
+
+    Страница выбирается по курсору (id, key) соседней страницы с LIMIT, поэтому время
+    загрузки не зависит от размера таблицы; общее количество записей кэшируется.
+    Поиск идёт по полнотекстовому индексу (совпадение всех слов по префиксу), который
+    перед поиском догоняет изменения базы не чаще раза в SEARCH_SYNC_SECONDS.
+    """
+    after = (after_id, after_key) if after_id is not None and after_key is not None else None
+    before = (before_id, before_key) if before_id is not None and before_key is not None else None
+    if after is None and before is None:
+        page = 1
+
+    if search and not match_expression(search):
+        search = None
+
+    with pool.read() as conn:
+        cursor = conn.cursor()
+        if search:
+            search_index = get_search_index()
+            if time.time() - search_index.last_sync > SEARCH_SYNC_SECONDS:
+                search_index.sync(conn)
+
+        total = count_records(cursor, search)
+        records, has_more = fetch_page(cursor, search, after=after, before=before)
+    total_pages = max(1, (total + PAGE_SIZE - 1) // PAGE_SIZE)
 
     # Формирование данных для отображения
     results = [
@@ -65,33 +526,36 @@ async def table_metadata_page(request: Request, page: int = Query(1, ge=1), sear
             "key": record["key"],
             "string_value": record["string_value"],
         }
-        for record in paginated_records
+        for record in records
     ]
 
-    conn.close()
+    # Соседние страницы существуют, если в направлении листания есть ещё записи
+    has_next = has_more if before is None else bool(results)
+    has_prev = page > 1 and bool(results) if before is None else has_more
 
     return templates.TemplateResponse("table.html", {
         "request": request,
         "records": results,
-        "page": page,
+        "page": min(page, total_pages),
         "total_pages": total_pages,
+        "total": total,
         "search": search,
+        "first": results[0] if results else None,
+        "last": results[-1] if results else None,
+        "has_next": has_next,
+        "has_prev": has_prev,
     })
 
 
 @router.get("/edit/{record_id}", response_class=HTMLResponse)
-async def edit_record_page(request: Request, record_id: int):
+def edit_record_page(request: Request, record_id: int):
     """
     Рендеринг страницы редактирования записи.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Проверка существования записи в таблице embedding_metadata
-    cursor.execute("SELECT * FROM embedding_metadata WHERE id = ?", (record_id,))
-    record_row = cursor.fetchone()
+    with pool.read() as conn:
+        # Проверка существования записи в таблице embedding_metadata
+        record_row = conn.execute("SELECT * FROM embedding_metadata WHERE id = ?", (record_id,)).fetchone()
     if not record_row:
-        conn.close()
         raise HTTPException(status_code=404, detail="Запись не найдена")
 
     # Формирование объекта записи
@@ -101,24 +565,36 @@ async def edit_record_page(request: Request, record_id: int):
         "string_value": record_row["string_value"],
     }
 
-    conn.close()
     return templates.TemplateResponse("edit_record.html", {"request": request, "record": record})
 
 
 @router.post("/edit/{record_id}")
-async def edit_record(record_id: int, key: str = Form(...), string_value: str = Form(None)):
+def edit_record(record_id: int, key: str = Form(...), string_value: str = Form(None)):
     """
     Обновление записи через форму.
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Обновление записи в базе данных короткой транзакцией
+    with pool.write() as conn:
+        conn.execute(
+            "UPDATE embedding_metadata SET key = ?, string_value = ? WHERE id = ?",
+            (key, string_value, record_id)
+        )
+    with pool.read() as conn:
+        get_search_index().refresh_record(conn, record_id)
 
-    # Обновление записи в базе данных
-    cursor.execute(
-        "UPDATE embedding_metadata SET key = ?, string_value = ? WHERE id = ?",
-        (key, string_value, record_id)
-    )
+    # Изменение ключа или значения меняет количество найденных записей
+    with _count_cache_lock:
+        _count_cache.clear()
+    return RedirectResponse(url="/table/", status_code=303)
 
-    conn.commit()
-    conn.close()
-    return RedirectResponse(url="/table/", status_code=303)
\ No newline at end of file
+
+@router.post("/reindex")
+def reindex_search():
+    """
+    Перестраивает полнотекстовый индекс поиска по таблице.
+    """
+    with pool.read() as conn:
+        get_search_index().rebuild(conn)
+    with _count_cache_lock:
+        _count_cache.clear()
+    return RedirectResponse(url="/table/", status_code=303)
@@ -1,62 +1,40 @@
 import os
-from langchain_chroma import Chroma
-from langchain_nomic.embeddings import NomicEmbeddings
-from langchain.schema import Document
-from app.document_utils import add_document_to_store
-from app.db_utils import remove_existing_documents
+from app.document_utils import initialize_database
+from app.pipeline_utils import add_sources_to_store
+from app.store_utils import get_vectorstore
 
-def initialize_vector_store(persist_directory="chroma_db", log_func=None):
+def initialize_vector_store(config, log_func=None):
     """
     Инициализирует базу данных с тестовой записью, если она не существует.
 
     Args:
-        persist_directory (str): Директория для сохранения базы.
+        config (Config): Конфигурационный объект.
         log_func (callable, optional): Функция для логирования.
 
     Returns:
         vectorstore: Инициализированное векторное хранилище.
     """
-    embeddings = NomicEmbeddings(model="nomic-embed-text-v1.5", inference_mode="local")
-    vectorstore = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
-
-    # Проверяем и инициализируем базу данных
-    try:
-        all_docs = vectorstore._collection.get()
-        if not all_docs['ids']:
-            if log_func:
-                log_func("База данных пуста. Добавление тестовой записи.")
-            test_document = Document(
-                page_content="Это тестовая запись для инициализации базы данных.",
-                metadata={"source": "test_source", "tag": "test"}
-            )
-            vectorstore.add_documents([test_document])
-            if log_func:
-                log_func("Тестовая запись успешно добавлена.")
-    except Exception as e:
-        if log_func:
-            log_func(f"Ошибка при инициализации базы данных: {e}")
-        raise
-
+    vectorstore = get_vectorstore(config, log_func)
+    initialize_database(vectorstore, config.vector_db.persist_directory, log_func)
     return vectorstore
 
-def add_urls_from_file(file_path, config, log_func=None):
+
+def read_url_entries(file_path, log_func=None):
     """
-    Добавляет записи из файла с URL и тегами в векторное хранилище.
+    Читает и проверяет строки файла со списком URL и тегов.
 
     Args:
         file_path (str): Путь к файлу, содержащему список URL и тегов.
-        config (Config): Конфигурационный объект.
         log_func (callable, optional): Функция для логирования.
 
+    Returns:
+        list: Список кортежей (url, tag).
+
     Raises:
-        FileNotFoundError: Если файл не найден.
+        FileNotFoundError: Если файл из списка не найден.
         ValueError: Если формат строки некорректный.
     """
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"Файл {file_path} не найден.")
-
-    vectorstore = initialize_vector_store(config.vector_db.persist_directory, log_func=log_func)
-
+    entries = []
     with open(file_path, 'r') as file:
         for line in file:
             line = line.strip()
@@ -68,15 +46,8 @@ def add_urls_from_file(file_path, config, log_func=None):
                 url = url.strip()
                 tag = tag.strip()
 
-                if log_func:
-                    log_func(f"Проверка и удаление существующих записей для URL или файла: {url}")
-
-                # Определяем, является ли источник URL или файлом
-                if url.startswith("http://") or url.startswith("https://"):
-                    source = url  # Для URL сохраняем полную ссылку
-                else:
-                    source = os.path.basename(url)  # Для файлов сохраняем только имя
-
+                # Для файлов проверяем формат и наличие заранее
+                if not (url.startswith("http://") or url.startswith("https://")):
                     # Проверка допустимого формата файла
                     if not (url.endswith(".txt") or url.endswith(".pdf")):
                         raise ValueError(f"Неподдерживаемый формат файла: {url}. Допустимы только .txt и .pdf")
@@ -88,14 +59,7 @@ def add_urls_from_file(file_path, config, log_func=None):
                     if os.path.getsize(absolute_path) == 0:
                         raise ValueError(f"Файл {absolute_path} пуст.")
 
-                # Удаляем старые записи, если они существуют
-                remove_existing_documents(vectorstore, source)
-
-                if log_func:
-                    log_func(f"Добавление источника: {source} с тегом: {tag}")
-
-                # Добавляем новый документ
-                add_document_to_store(source=url, tag=tag, config=config, log_func=log_func)
+                entries.append((url, tag))
 
             except ValueError as ve:
                 if log_func:
@@ -105,10 +69,41 @@ def add_urls_from_file(file_path, config, log_func=None):
                 if log_func:
                     log_func(f"Ошибка: {fnfe}")
                 raise fnfe
-            except Exception as e:
-                if log_func:
-                    log_func(f"Непредвиденная ошибка: {e}")
-                raise e
+    return entries
+
+
+def add_urls_from_file(file_path, config, log_func=None, force=False, concurrency=None):
+    """
+    Добавляет записи из файла с URL и тегами в векторное хранилище.
+    Источники, не изменившиеся с прошлой загрузки, пропускаются.
+
+    Все источники из файла добавляются одним пакетом через потоковый конвейер
+    add_sources_to_store: одна инициализация хранилища, одно удаление старых записей
+    на источник, параллельная загрузка и пакетная запись.
+
+    Args:
+        file_path (str): Путь к файлу, содержащему список URL и тегов.
+        config (Config): Конфигурационный объект.
+        log_func (callable, optional): Функция для логирования.
+        force (bool): Перезагрузить все источники независимо от манифеста.
+        concurrency (int, optional): Количество потоков загрузки
+            (по умолчанию ingest.fetch_concurrency).
+
+    Returns:
+        dict: Количество загруженных и пропущенных источников и статистика стадий.
+
+    Raises:
+        FileNotFoundError: Если файл не найден.
+        ValueError: Если формат строки некорректный.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"Файл {file_path} не найден.")
+
+    entries = read_url_entries(file_path, log_func=log_func)
+    result = add_sources_to_store(
+        entries, config, log_func=log_func, force=force, concurrency=concurrency
+    )
 
     if log_func:
         log_func("Все записи успешно добавлены.")
+    return result
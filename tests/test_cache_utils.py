@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip("langchain_core")
+
+from app.cache_utils import EmbeddingCache, text_hash
+
+
+def test_get_many_partial_hit(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.sqlite3"))
+    known = {text_hash(text): [float(i)] for i, text in enumerate(["a", "b"])}
+    cache.put_many("model", 0, known)
+
+    hashes = [text_hash(text) for text in ["a", "b", "c", "d"]]
+    found = cache.get_many("model", 0, hashes)
+
+    assert found == known
+    assert cache.hits == 2
+    assert cache.misses == 2
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("click")
+pytest.importorskip("yaml")
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# Бюджет на импорт app.cli (микросекунды, по -X importtime)
+IMPORT_BUDGET_US = 500_000
+
+HEAVY_MODULES = ("langchain", "chromadb", "langchain_nomic", "fitz")
+
+
+def import_times(statement):
+    """
+    Выполняет statement в отдельном интерпретаторе с -X importtime и возвращает
+    совокупное время импорта каждого модуля в микросекундах.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def test_cli_import_skips_heavy_modules():
+    times = import_times("import app.cli")
+    heavy = [
+        name for name in times
+        if name.split(".")[0] in HEAVY_MODULES or name.startswith("langchain_")
+    ]
+    assert heavy == []
+
+
+def test_cli_import_within_budget():
+    times = import_times("import app.cli")
+    assert times["app.cli"] < IMPORT_BUDGET_US